@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from audio_read import file_pitch_track
+from batch_analysis import track_columns
+
+cache_version = 5  # changes whenever cached results of the same parameters would differ
+
+
+class analysis_cache:
+    """
+    A persistent cache of offline pitch tracks, keyed by the content of the audio file and the analysis parameters
+
+    Each entry is a directory of .npy files (one per pitch track column) named by the hash of the key, so renamed or
+    copied files hit the same entry and edited files never hit a stale one. Entries are loaded back as read-only memory
+    maps. The total size is capped, evicting the least recently used entries first.
+
+    The index (entry sizes, last use times and the content hashes of known files) is kept in 'index.json', file hashes
+    are only recomputed when the size or modification time of a file changes.
+    """
+
+    def __init__(self, directory='.analysis_cache', max_size=512 * 1024 * 1024):
+        """
+        :param directory: the directory of the cache (created if missing)
+        :param max_size: the maximum total size of the cached arrays in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.index_name = os.path.join(directory, 'index.json')
+        try:
+            with open(self.index_name) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+        self.index.setdefault('entries', {})
+        self.index.setdefault('files', {})
+
+    def file_hash(self, file_name):
+        """
+        :param file_name: the name of the audio file
+        :return: the SHA-256 hex digest of the content of the file
+        """
+        stat = os.stat(file_name)
+        path = os.path.abspath(file_name)
+        known = self.index['files'].get(path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.index['files'][path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def key(self, file_name, window, hop, f_0, channel=0, analyzer_options=None):
+        """
+        :return: the cache key of the pitch track of a file (see audio_read.file_pitch_track for the parameters)
+        """
+        parameters = {
+            'version': cache_version,
+            'file': self.file_hash(file_name),
+            'window': window,
+            'hop': hop,
+            'f_0': f_0,
+            'channel': channel,
+            'analyzer_options': analyzer_options or {},
+        }
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+    def load(self, key):
+        """
+        :param key: the cache key (see key)
+        :return: the cached pitch track tuple of memory-mapped arrays, or None if it is not cached
+        """
+        entry = self.index['entries'].get(key)
+        entry_directory = os.path.join(self.directory, key)
+        if entry is None or not os.path.isdir(entry_directory):
+            self.misses += 1
+            return None
+
+        try:
+            track = tuple(np.load(os.path.join(entry_directory, column + '.npy'), mmap_mode='r')
+                          for column in track_columns)
+        except (OSError, ValueError):
+            self.discard(key)
+            self.misses += 1
+            return None
+
+        entry['used'] = time.time()
+        self.hits += 1
+        return track
+
+    def store(self, key, track):
+        """
+        Stores a pitch track and evicts the least recently used entries above the size cap
+
+        :param key: the cache key (see key)
+        :param track: a tuple with the time, frequency, note, cents and amplitude arrays
+        """
+        entry_directory = os.path.join(self.directory, key)
+        partial_directory = entry_directory + '.partial'
+        shutil.rmtree(partial_directory, ignore_errors=True)
+        os.makedirs(partial_directory)
+
+        size = 0
+        for column, values in zip(track_columns, track):
+            column_name = os.path.join(partial_directory, column + '.npy')
+            np.save(column_name, np.asarray(values))
+            size += os.path.getsize(column_name)
+
+        shutil.rmtree(entry_directory, ignore_errors=True)
+        os.replace(partial_directory, entry_directory)
+        self.index['entries'][key] = {'size': size, 'used': time.time()}
+        self.evict()
+
+    def pitch_track(self, file_name, window=1, hop=0.05, f_0=440.0, channel=0, analyzer_options=None):
+        """
+        Returns the cached pitch track of a file, computing and storing it on a miss (see
+        audio_read.file_pitch_track)
+        """
+        key = self.key(file_name, window, hop, f_0, channel, analyzer_options)
+        track = self.load(key)
+        if track is None:
+            track = file_pitch_track(file_name, window, hop, f_0, channel, analyzer_options=analyzer_options)
+            self.store(key, track)
+        self.save()
+        return track
+
+    def discard(self, key):
+        self.index['entries'].pop(key, None)
+        shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    def evict(self):
+        entries = self.index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['used']):
+            if total <= self.max_size:
+                break
+            total -= entries[key]['size']
+            self.discard(key)
+
+    def save(self):
+        """
+        Writes the index, call after loading or storing entries
+        """
+        self.index['files'] = {path: known for path, known in self.index['files'].items() if os.path.exists(path)}
+        partial_name = self.index_name + '.partial'
+        with open(partial_name, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(partial_name, self.index_name)
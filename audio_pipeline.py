@@ -0,0 +1,475 @@
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from configparser import ConfigParser
+
+import numpy as np
+from scipy.fft import rfft
+
+from audio_read import ring_buffer, real_time_audio_capture
+from audio_utils import decimator, energy_gate, frequency_to_note_details, spectrum_analyzer
+from instrumentation import no_stats
+from pitch_detection import create_pitch_detector
+from session_recorder import session_recorder
+
+analysis_result = namedtuple('analysis_result', ['frequency', 'amplitude', 'closest_frequency', 'note', 'octave',
+                                                 'cents', 'neighbour_distance'])
+silent_result = analysis_result(0.0, 0.0, None, None, None, None, None)
+
+
+class multi_result(tuple):
+    """
+    The result of a window of a multi-channel source (an analysis_result per channel) or of polyphonic analysis (an
+    analysis_result per voice), consumers tell it from a single analysis_result with isinstance
+    """
+
+
+settings_file = 'settings.ini'
+
+
+def gate_settings_key(source, decimation=1):
+    """
+    :param source: an audio_read.audio_source
+    :param decimation: the decimation factor of the pipeline (filtering changes the noise level)
+    :return: the settings.ini option storing the energy gate threshold of the source input device and channel count
+    (None for sources that are not an input device)
+    """
+    if source.device_name is None:
+        return None
+    key = 'input_{}_{}ch'.format(source.device_name, source.channels)
+    return key if decimation == 1 else key + '_decimate{}'.format(decimation)
+
+
+def format_gate_threshold(threshold):
+    return ','.join('{:.6g}'.format(value) for value in np.atleast_1d(threshold))
+
+
+def parse_gate_threshold(text):
+    """
+    :param text: the threshold as written by format_gate_threshold
+    :return: the threshold (a numpy array with one threshold per channel for several channels)
+    """
+    threshold = np.array([float(value) for value in text.split(',')])
+    return float(threshold[0]) if len(threshold) == 1 else threshold
+
+
+def read_gate_threshold(key, file_name=settings_file):
+    """
+    :param key: the settings option of the input (see gate_settings_key)
+    :param file_name: the settings file
+    :return: the stored energy gate threshold of the input, or None if it was never calibrated
+    """
+    config = ConfigParser()
+    config.read(file_name)
+    if key is None or not config.has_option('gate', key):
+        return None
+    return parse_gate_threshold(config['gate'][key])
+
+
+def write_gate_threshold(key, threshold, file_name=settings_file):
+    """
+    Stores the energy gate threshold of an input, keeping the other settings
+    """
+    config = ConfigParser()
+    config.read(file_name)
+    if not config.has_section('gate'):
+        config['gate'] = {}
+    config['gate'][key] = format_gate_threshold(threshold)
+    with open(file_name, 'w') as configfile:
+        config.write(configfile)
+
+
+class audio_pipeline:
+    """
+    Captures audio and analyzes overlapping windows on background threads
+
+    Capture runs in PyAudio callback mode (or any other audio_read.audio_source) and feeds a bounded queue, analysis
+    runs on a worker thread and only the latest result is kept, so consumers (e.g. the GUI) can poll without blocking.
+    When the worker falls behind a live source, the queued blocks are all written to the ring buffer but only the
+    newest window is analyzed; windows of other sources (e.g. fast file replay) are all analyzed.
+
+    Blocks can be decimated before buffering (notes above audio_utils.max_frequency are never reported), so the same
+    window length in seconds needs a FFT that many times smaller. An energy gate skips pitch detection of quiet windows,
+    its threshold is given or measured from the noise floor of the input (see calibrate).
+
+    Multi-channel sources (several inputs or devices) are buffered as a channels x samples matrix and analyzed with one
+    batched FFT/HPS, each result is then a multi_result with an independent analysis_result per channel.
+
+    In polyphonic mode (voices > 1, e.g. to tune all strings from one strum) up to voices simultaneous notes are found
+    in the spectrum of each window (see audio_utils.spectrum_analyzer.analyze_voices), each result is then a
+    multi_result of voices analysis_results ordered by frequency, padded with silent results.
+    """
+
+    def __init__(self, window=0.5, hop=0.05, f_0=440.0, analyzer_options=None, rate=44100, queue_size=16,
+                 stats=no_stats, source=None, gate_threshold=None, decimation=1, voices=1):
+        """
+        :param window: the length of the analysis window in seconds
+        :param hop: the time between consecutive windows in seconds
+        :param f_0: the frequency of A4 note (can be changed while running)
+        :param analyzer_options: keyword arguments for the pitch detector (see pitch_detection.create_pitch_detector)
+        :param rate: the sample rate of the audio input
+        :param queue_size: the maximum number of captured blocks waiting for analysis
+        :param stats: the per-stage timing instrumentation (see instrumentation.pipeline_stats)
+        :param source: the audio source (default: audio input, rate and queue_size are ignored otherwise)
+        :param gate_threshold: the window RMS below which pitch detection is skipped, a number or one per channel
+        (None analyzes every window with the amplitude threshold of the detector)
+        :param decimation: the decimation factor applied before analysis (e.g. 10 analyzes 44.1 kHz input at 4.41 kHz,
+        the FFT/HPS detector then only finds fundamentals below rate / (2 * harmonics))
+        :param voices: the maximum number of simultaneous notes found in a window (needs the FFT/HPS detector and a
+        single channel, 1 finds only the loudest note)
+        """
+        if hop <= 0 or hop > window:
+            raise ValueError('hop must be positive and not larger than window.')
+
+        self.f_0 = f_0
+        if source is None:
+            source = real_time_audio_capture(int(rate * hop), rate, queue_size)
+        rate = source.rate
+        self.capture = source
+        self.channels = source.channels
+        self.decimator = None
+        if decimation > 1:
+            self.decimator = decimator(rate, decimation)
+            rate = self.decimator.sample_rate
+        self.rate = rate  # the sample rate of the analyzed windows
+        self.buffer = ring_buffer(int(rate * window), channels=self.channels if self.channels > 1 else None)
+        # a detector of its own, the stats (and the state of tracking detectors) are not shared with other users
+        self.analyzer = create_pitch_detector(rate, int(rate * window), **(analyzer_options or {}))
+        self.voices = voices
+        self.silent_voices = multi_result((silent_result,) * voices)  # the result of a gated window in polyphonic mode
+        if voices > 1 and (self.channels > 1 or not hasattr(self.analyzer, 'analyze_voices')):
+            raise ValueError('Polyphonic analysis needs the hps detector and a single channel.')
+        self.stats = stats
+        self.analyzer.stats = stats
+        self.gate = energy_gate(gate_threshold)
+        self.calibration = None  # (end time, margin, callback, noise levels) while calibrating
+        self.spectrogram = None  # recent (spectrum column, result) pairs of the shown channel, see enable_spectrogram
+        self.recorder = None  # see record
+
+        self.results = 0  # number of analyzed frames
+        self.skipped_frames = 0  # frames not analyzed because the worker was behind
+        self.finished = False  # the source has ended
+
+        self.latest_result = None
+        self.listeners = ()
+        self.lock = threading.Lock()
+        self.result_ready = threading.Condition(self.lock)
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(target=self.run, name='audio_pipeline', daemon=True)
+
+    @property
+    def overflows(self):
+        return self.capture.overflows
+
+    @property
+    def dropped_blocks(self):
+        return self.capture.dropped_blocks
+
+    def start(self):
+        self.capture.start()
+        self.worker.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.worker.is_alive():
+            self.worker.join()
+        self.capture.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def record(self, prefix, **options):
+        """
+        Records the captured audio and the results to '<prefix>.wav' and '<prefix>.npz' until the pipeline is stopped
+        (see session_recorder.session_recorder, must be called before start)
+
+        :param prefix: the output file name without extension
+        :param options: keyword arguments passed to session_recorder (queue_size, batch_size)
+        """
+        self.recorder = session_recorder(prefix, self.capture.rate, self.channels,
+                                         multiple=self.channels > 1 or self.voices > 1, **options)
+
+    def add_listener(self, listener):
+        """
+        Registers a function called on the worker thread with every result, and with None when the source ends (must
+        not block, see audio_stream.result_hub)
+        """
+        with self.lock:
+            self.listeners += (listener,)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            self.listeners = tuple(l for l in self.listeners if l is not listener)
+
+    def calibrate(self, duration=2.0, margin=4.0, callback=None):
+        """
+        Measures the noise floor of the input and sets the energy gate threshold from it, the input should be quiet
+        (no results are produced meanwhile)
+
+        :param duration: the measurement time in seconds
+        :param margin: the threshold as a multiple of the noise level (see audio_utils.energy_gate.calibrate)
+        :param callback: a function called on the worker thread with the threshold when done
+        """
+        with self.lock:
+            self.calibration = (time.perf_counter() + duration, margin, callback, [])
+
+    def enable_spectrogram(self, rows=160, min_frequency=40.0, max_frequency=2000.0, history=64):
+        """
+        Keeps a log-frequency spectrum column of every analyzed window for display (see gui.spectrogram_view)
+
+        Columns reuse the spectrum of the FFT/HPS detector, other detectors (and multi-channel sources, the first
+        channel is shown) need one more FFT per window. Each column is only rows values, the consumer reads them from
+        spectrogram (a deque, the oldest columns are dropped when the consumer is behind) together with the result of
+        the shown channel: an analysis_result, or the multi_result of all voices in polyphonic mode.
+
+        :param rows: the number of frequency rows (log spaced, lowest first)
+        :param min_frequency: the frequency of the lowest row
+        :param max_frequency: the frequency of the highest row
+        :param history: the number of columns kept for the consumer
+        """
+        self.spectrogram_frequencies = min_frequency * (max_frequency / min_frequency) ** np.linspace(0, 1, rows)
+        self.spectrogram_edges = {}  # FFT size to the first bin of each row
+        self.spectrogram = deque(maxlen=history)
+
+    def spectrum_column(self, window, result):
+        """
+        :param window: the window of the shown channel
+        :param result: the result of the shown channel (see enable_spectrogram)
+        :return: the log magnitude of the loudest bin of each spectrogram row
+        """
+        if result is silent_result or result is self.silent_voices:
+            # gated window, nothing was transformed
+            return np.full(len(self.spectrogram_frequencies), np.log(np.finfo(np.float32).tiny), dtype=np.float32)
+
+        if type(self.analyzer) is spectrum_analyzer and self.channels == 1:
+            magnitude, fft_size = self.analyzer.magnitude, self.analyzer.fft_size
+        else:
+            magnitude, fft_size = np.abs(rfft(window)), len(window)
+
+        edges = self.spectrogram_edges.get(fft_size)
+        if edges is None:
+            # each row covers the bins from its frequency up to the next row (one more edge closes the last row)
+            frequencies = self.spectrogram_frequencies
+            frequencies = np.append(frequencies, frequencies[-1] ** 2 / frequencies[-2])
+            bins = np.round(frequencies * fft_size / self.rate).astype(int)
+            edges = self.spectrogram_edges[fft_size] = np.minimum(bins, len(magnitude) - 1)
+        column = np.maximum.reduceat(magnitude, edges)[:-1]
+        return np.log(np.maximum(column, np.finfo(np.float32).tiny)).astype(np.float32)
+
+    def calibrating(self):
+        return self.calibration is not None
+
+    def latest(self):
+        """
+        Returns the latest result that has not been returned yet, without blocking
+
+        :return: an analysis_result (a multi_result for multi-channel sources or polyphonic analysis), or None if no
+        new window was analyzed since the last call
+        """
+        with self.lock:
+            result = self.latest_result
+            self.latest_result = None
+        return result
+
+    def wait_result(self, timeout=None):
+        """
+        Waits for a result that has not been returned yet (used by consumers without an event loop)
+
+        :param timeout: the maximum time to wait in seconds (None waits forever)
+        :return: an analysis_result (a multi_result for multi-channel sources or polyphonic analysis), or None on
+        timeout
+        """
+        with self.result_ready:
+            self.result_ready.wait_for(lambda: self.latest_result is not None or self.finished, timeout)
+            result = self.latest_result
+            self.latest_result = None
+        return result
+
+    def run(self):
+        while not self.stop_event.is_set():
+            start = self.stats.time()
+            try:
+                capture_time, block = self.capture.read(timeout=0.1)
+            except queue.Empty:
+                continue
+            # time spent waiting for the next captured block (idle time, not the capture itself)
+            start = self.stats.record('wait', start)
+
+            # write every block that arrived meanwhile, analyze only the newest window
+            pending = 0
+            ended = block is None  # a None block marks the end of the source
+            while not ended:
+                if self.recorder is not None:
+                    self.recorder.write_audio(block)
+                self.buffer.write(block if self.decimator is None else self.decimator.process(block))
+                pending += 1
+                if not self.capture.live:
+                    break
+                try:
+                    next_time, block = self.capture.read_nowait()
+                except queue.Empty:
+                    break
+                ended = block is None
+                if not ended:
+                    capture_time = next_time
+
+            if not pending or not self.buffer.full():
+                if ended:
+                    self.finish()
+                    return
+                continue
+            self.stats.record('buffer', start)
+
+            self.skipped_frames += pending - 1
+            if self.calibration is not None:
+                self.measure_noise(self.buffer.window())
+                if ended:
+                    self.finish()
+                    return
+                continue
+
+            if self.channels > 1:
+                result = self.analyze_channels(self.buffer.window())
+            else:
+                result = self.analyze(self.buffer.window())
+            self.stats.record('latency', capture_time)
+
+            if self.spectrogram is not None:
+                start = self.stats.time()
+                # multi-channel sources show their first channel, the harmonics of its note are marked from its own
+                # result (gui.spectrogram_view reads single results, or the voices of a polyphonic one)
+                window = self.buffer.window()
+                if self.channels > 1:
+                    window, shown = window[0], result[0]
+                else:
+                    shown = result
+                self.spectrogram.append((self.spectrum_column(window, shown), shown))
+                self.stats.record('spectrum', start)
+
+            if self.recorder is not None:
+                self.recorder.write_result(result)
+                self.stats.set('unrecorded', self.recorder.dropped)
+
+            with self.lock:
+                self.latest_result = result
+                self.results += 1
+                self.result_ready.notify_all()
+            for listener in self.listeners:
+                listener(result)
+
+            self.stats.count('frames')
+            self.stats.set('skipped', self.skipped_frames)
+            self.stats.set('dropped', self.dropped_blocks)
+            self.stats.set('overflows', self.overflows)
+
+            if ended:
+                self.finish()
+                return
+
+    def finish(self):
+        with self.lock:
+            self.finished = True
+            self.result_ready.notify_all()
+        for listener in self.listeners:
+            listener(None)
+
+    def measure_noise(self, signal):
+        with self.lock:
+            end, margin, callback, levels = self.calibration
+        levels.append(self.gate.level(signal))
+        if time.perf_counter() < end:
+            return
+
+        threshold = self.gate.calibrate(np.array(levels), margin)
+        self.gate.threshold = threshold if self.channels > 1 else float(threshold)
+        with self.lock:
+            self.calibration = None
+        if callback is not None:
+            callback(self.gate.threshold)
+
+    def min_amplitude(self):
+        # a calibrated gate already rejected the quiet windows, the device dependent detector threshold is not needed
+        return 0 if self.gate.threshold is not None else self.analyzer.amplitude_threshold
+
+    def analyze(self, signal):
+        """
+        Analyzes a window and maps its loudest frequency to a note
+
+        :param signal: the window of audio signal in numpy array format
+        :return: an analysis_result (note fields are None if no note was detected)
+        """
+        start = self.stats.time()
+        if not self.gate.is_open(signal):
+            self.stats.record('gate', start)
+            self.stats.count('gated')
+            return silent_result if self.voices == 1 else self.silent_voices
+        start = self.stats.record('gate', start)
+
+        if self.voices > 1:
+            return self.analyze_voices(signal, start)
+
+        loudest_frequency, loudest_frequency_amplitude = self.analyzer.analyze(signal)
+        start = self.stats.record('detect', start)
+        details = frequency_to_note_details(loudest_frequency, loudest_frequency_amplitude, self.f_0,
+                                            self.min_amplitude())
+        self.stats.record('note', start)
+
+        return analysis_result(loudest_frequency, loudest_frequency_amplitude, *details)
+
+    def analyze_channels(self, windows):
+        """
+        Analyzes the windows of all channels in one batch and maps their loudest frequencies to notes in one pass
+
+        :param windows: the windows of audio signal as a channels x samples numpy array
+        :return: a multi_result with an analysis_result per channel (note fields are None if no note was detected)
+        """
+        start = self.stats.time()
+        gate_open = self.gate.is_open(windows)
+        start = self.stats.record('gate', start)
+        self.stats.count('gated', int(np.count_nonzero(~gate_open)))
+        if not gate_open.any():
+            return multi_result((silent_result,) * self.channels)
+
+        # only the channels above the gate are analyzed
+        loudest_frequency = np.zeros(self.channels)
+        loudest_frequency_amplitude = np.zeros(self.channels)
+        if gate_open.all():
+            loudest_frequency[:], loudest_frequency_amplitude[:] = self.analyzer.analyze_frames(windows)
+        else:
+            loudest_frequency[gate_open], loudest_frequency_amplitude[gate_open] = \
+                self.analyzer.analyze_frames(windows[gate_open])
+        start = self.stats.record('detect', start)
+        return multi_result(self.note_results(loudest_frequency, loudest_frequency_amplitude, start))
+
+    def analyze_voices(self, signal, start):
+        """
+        Finds the simultaneous notes of a window and maps them all to notes in one pass
+
+        :return: a multi_result of voices analysis_results ordered by frequency (unused voices are silent results)
+        """
+        frequencies, amplitudes = self.analyzer.analyze_voices(signal, self.voices)
+        start = self.stats.record('detect', start)
+        order = np.argsort(frequencies)
+        results = self.note_results(frequencies[order], amplitudes[order], start)
+        # notes below the amplitude threshold count as unused voices
+        voiced = tuple(result for result in results if result.note is not None)
+        return multi_result(voiced + (silent_result,) * (self.voices - len(voiced)))
+
+    def note_results(self, frequencies, amplitudes, start):
+        """
+        Maps detected frequencies to notes in one vectorized pass
+
+        :return: a tuple with an analysis_result per frequency (note fields are None if no note was detected)
+        """
+        details = frequency_to_note_details(frequencies, amplitudes, self.f_0, self.min_amplitude())
+        self.stats.record('note', start)
+
+        results = []
+        for frequency, amplitude, closest_frequency, note, octave, cents, distance in zip(
+                frequencies, amplitudes, *details):
+            if note:
+                results.append(analysis_result(float(frequency), float(amplitude), float(closest_frequency), str(note),
+                                               str(octave), float(cents), float(distance)))
+            else:
+                results.append(analysis_result(float(frequency), float(amplitude), None, None, None, None, None))
+        return tuple(results)
@@ -1,8 +1,10 @@
-from scipy.io import wavfile
-import matplotlib.pyplot as plt
 import numpy as np
-import pyaudio
+import queue
+import struct
+import threading
+import time
 from audio_utils import audio_fft
+from pitch_detection import create_pitch_detector, pitch_track
 
 
 def read_audio_file(file_name):
@@ -15,7 +17,13 @@ def read_audio_file(file_name):
 
     # only Wave format supported
     if file_name.endswith('.wav'):
+        from scipy.io import wavfile
+
         sample_rate, signal = wavfile.read(file_name)
+        if signal.ndim == 1:
+            # mono file, both channels are the same
+            return sample_rate, signal, signal
+
         left_channel_signal = signal[:, 0]
         right_channel_signal = signal[:, 1]
 
@@ -24,6 +32,164 @@ def read_audio_file(file_name):
         raise Exception('Unsupported Audio Format')
 
 
+def map_audio_file(file_name):
+    """
+    Memory-maps the samples of a Wave file without reading them into memory
+
+    Supports PCM (8, 16, 24 and 32 bit) and IEEE float (32 and 64 bit) samples with any number of channels.
+
+    :param file_name: the name of the audio file to map
+    :return: a tuple with the sample rate and a read-only numpy memmap of shape (frames, channels) (24 bit samples are
+    mapped as raw bytes with shape (frames, channels, 3))
+    """
+
+    if not file_name.endswith('.wav'):
+        raise Exception('Unsupported Audio Format')
+
+    sample_rate = None
+    dtype = None
+    channels = None
+
+    with open(file_name, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError('Not a Wave file.')
+
+        # iterate chunks until the data chunk
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError('Wave file has no data chunk.')
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                format_tag, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+                if format_tag == 0xFFFE:  # WAVE_FORMAT_EXTENSIBLE, real format in sub-format GUID
+                    format_tag = struct.unpack('<H', fmt[24:26])[0]
+
+                if format_tag == 1 and bits in (8, 16, 24, 32):
+                    dtype = {8: np.uint8, 16: '<i2', 24: np.uint8, 32: '<i4'}[bits]
+                elif format_tag == 3 and bits in (32, 64):
+                    dtype = {32: '<f4', 64: '<f8'}[bits]
+                else:
+                    raise ValueError('Unsupported Wave format ({}, {} bit).'.format(format_tag, bits))
+                if chunk_size % 2:
+                    f.seek(1, 1)
+            elif chunk_id == b'data':
+                if dtype is None:
+                    raise ValueError('Wave file has no format chunk.')
+                offset = f.tell()
+                break
+            else:
+                # skip unknown chunk (chunks are padded to even sizes)
+                f.seek(chunk_size + chunk_size % 2, 1)
+
+    sample_width = 3 if bits == 24 else np.dtype(dtype).itemsize
+    frames = chunk_size // (sample_width * channels)
+    shape = (frames, channels, 3) if bits == 24 else (frames, channels)
+    if frames == 0:
+        return sample_rate, np.zeros(shape, dtype=dtype)
+
+    return sample_rate, np.memmap(file_name, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+def read_audio_file_blocks(file_name, block_size=65536, channel=0, start=0, stop=None):
+    """
+    Reads an audio file in fixed-size blocks through a memory map and yields audio signal in numpy array format
+
+    Only one block is converted at a time, so memory use does not depend on the length of the file.
+
+    :param file_name: the name of the audio file to read
+    :param block_size: the number of samples in each block (the last block may be shorter)
+    :param channel: the channel to read, or None to read all channels
+    :param start: the first sample to read
+    :param stop: the sample to stop reading at (None reads to the end of the file)
+    :return: a tuple with the sample rate and a float32 block of audio signal in numpy array format (shape (samples,)
+    for a single channel or (samples, channels) for all channels)
+    """
+
+    sample_rate, samples = map_audio_file(file_name)
+    stop = len(samples) if stop is None else min(stop, len(samples))
+
+    for position in range(start, stop, block_size):
+        block = samples[position:min(position + block_size, stop)]
+        if channel is not None:
+            block = block[:, channel]
+
+        if samples.ndim == 3:
+            # 24 bit samples, assemble left-justified int32 values
+            block = block.astype(np.int32)
+            block = (block[..., 0] << 8) | (block[..., 1] << 16) | (block[..., 2] << 24)
+
+        yield sample_rate, normalize_signal(np.asarray(block))
+
+
+def file_pitch_track(file_name, window=1, hop=0.05, f_0=440.0, channel=0, block_size=1 << 20, analyzer_options=None,
+                     start=0, stop=None):
+    """
+    Computes the pitch track of an audio file, reading it in blocks so long recordings are never fully loaded
+
+    :param file_name: the name of the audio file to read
+    :param window: the length of the analysis window in seconds
+    :param hop: the time between consecutive windows in seconds
+    :param f_0: the frequency of A4 note (default: 440.0)
+    :param channel: the channel to analyze
+    :param block_size: the number of samples read at a time
+    :param analyzer_options: keyword arguments for the pitch detector (see pitch_detection.get_pitch_detector)
+    :param start: the sample where the first frame starts
+    :param stop: only frames starting before this sample are analyzed (None analyzes to the end of the file), ranges
+    that are a multiple of the hop long tile the pitch track of the whole file
+    :return: a tuple of numpy arrays with the time, loudest frequency, closest note, cents and amplitude of each frame
+    (see pitch_detection.pitch_track)
+    """
+
+    sample_rate, _ = map_audio_file(file_name)
+    frame_size = int(sample_rate * window)
+    hop_size = int(sample_rate * hop)
+    # one detector for the whole file, the blocks are a single stream (e.g. the note held by YIN and McLeod)
+    analyzer = create_pitch_detector(sample_rate, frame_size, **(analyzer_options or {}))
+    if stop is not None:
+        stop += frame_size - hop_size  # the last frame needs a whole window of samples
+
+    tracks = []
+    carry = np.empty(0, dtype=np.float32)
+    carry_start = start  # position of the first carried sample in the file
+
+    for sample_rate, block in read_audio_file_blocks(file_name, block_size, channel, start, stop):
+
+        chunk = np.concatenate((carry, block))
+        time, frequency, note, cents, amplitude = pitch_track(chunk, sample_rate, window, hop, f_0,
+                                                              analyzer_options=analyzer_options, analyzer=analyzer)
+        tracks.append((time + carry_start / sample_rate, frequency, note, cents, amplitude))
+
+        # keep the samples needed by the frames that did not fit in this chunk
+        consumed = len(time) * hop_size
+        carry = chunk[consumed:]
+        carry_start += consumed
+
+    if not tracks:
+        return tuple(np.empty(0) for _ in range(5))
+
+    return tuple(np.concatenate(column) for column in zip(*tracks))
+
+
+def normalize_signal(signal):
+    """
+    Converts an audio signal to float32 in the range [-1, 1], like the signal read from audio input
+
+    :param signal: the audio signal in numpy array format (integer or float samples)
+    :return: the audio signal as a float32 numpy array
+    """
+
+    if signal.dtype == np.uint8:
+        return (signal.astype(np.float32) - 128) / 128
+    if np.issubdtype(signal.dtype, np.integer):
+        return signal.astype(np.float32) / -np.iinfo(signal.dtype).min
+
+    return signal.astype(np.float32, copy=False)
+
+
 def read_real_time_audio(interval=1):
     """
     Reads real time audio from audio input and yields audio signal in numpy array format
@@ -31,6 +197,8 @@ def read_real_time_audio(interval=1):
     :return: a tuple with the sample rate and audio signal in numpy array format
     """
 
+    import pyaudio  # PortAudio is only needed for audio input, not for files or synthetic tones
+
     try:
         rate = 44100
         chunk_size = int(rate * interval)
@@ -50,6 +218,412 @@ def read_real_time_audio(interval=1):
         p.terminate()
 
 
+class ring_buffer:
+    """
+    Fixed-size ring buffer holding the most recent samples of an audio stream
+
+    Samples are written twice (at their position and one buffer length later) so the latest window is always
+    available as a contiguous view without copying. Multi-channel buffers keep one row per channel, so the latest
+    windows of all channels form a channels x samples matrix.
+    """
+
+    def __init__(self, size, dtype=np.float32, channels=None):
+        """
+        :param size: the number of samples to keep (analysis window length)
+        :param dtype: the sample data type
+        :param channels: the number of channels (None for a single channel written as a 1-D signal)
+        """
+        self.size = size
+        self.buffer = np.zeros(2 * size if channels is None else (channels, 2 * size), dtype=dtype)
+        self.position = 0  # index of the oldest sample
+        self.count = 0  # number of samples written so far (saturates at size)
+
+    def write(self, samples):
+        """
+        Appends samples to the buffer, overwriting the oldest ones
+
+        :param samples: the new samples in numpy array format (shape (samples, channels) for multi-channel buffers,
+        e.g. an interleaved block)
+        """
+        n = min(len(samples), self.size)
+        samples = samples[len(samples) - n:].T  # channels to rows, a view
+
+        first = min(n, self.size - self.position)
+        self.buffer[..., self.position:self.position + first] = samples[..., :first]
+        self.buffer[..., self.position + self.size:self.position + self.size + first] = samples[..., :first]
+        if n > first:
+            self.buffer[..., :n - first] = samples[..., first:]
+            self.buffer[..., self.size:self.size + n - first] = samples[..., first:]
+
+        self.position = (self.position + n) % self.size
+        self.count = min(self.count + n, self.size)
+
+    def full(self):
+        """
+        :return: True if a whole window of samples has been written
+        """
+        return self.count == self.size
+
+    def window(self):
+        """
+        Returns the most recent samples in chronological order
+
+        :return: a view of the buffer (overwritten by subsequent writes), channels x samples for multi-channel buffers
+        """
+        return self.buffer[..., self.position:self.position + self.size]
+
+
+def read_real_time_audio_stream(window=1, hop=0.05):
+    """
+    Reads real time audio from audio input and yields overlapping analysis windows in numpy array format
+
+    A new window is yielded every hop, so the window length (frequency resolution) and the update rate can be set
+    independently.
+
+    :param window: the length of the analysis window in seconds
+    :param hop: the time between consecutive windows in seconds
+    :return: a tuple with the sample rate and the latest window of audio signal (a view that is reused between
+    iterations)
+    """
+
+    if hop <= 0 or hop > window:
+        raise ValueError('hop must be positive and not larger than window.')
+
+    import pyaudio  # PortAudio is only needed for audio input, not for files or synthetic tones
+
+    p = None
+    stream = None
+    try:
+        rate = 44100
+        window_size = int(rate * window)
+        hop_size = int(rate * hop)
+
+        buffer = ring_buffer(window_size)
+
+        p = pyaudio.PyAudio()
+        stream = p.open(format=pyaudio.paFloat32, channels=1, rate=rate, input=True, frames_per_buffer=hop_size)
+
+        # iteratively read hops from audio stream and yield the latest window
+        while True:
+            data = stream.read(hop_size, exception_on_overflow=False)
+            buffer.write(np.frombuffer(data, dtype=np.float32))
+            if buffer.full():
+                yield rate, buffer.window()
+
+    finally:
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+        if p is not None:
+            p.terminate()
+
+
+class audio_source:
+    """
+    Base class of the audio sources feeding blocks of audio signal to the analysis pipeline
+
+    Blocks are passed through a bounded queue together with the time they were captured. Live sources never wait for
+    the consumer: when the queue is full the oldest block is dropped. Other sources (e.g. replay as fast as possible)
+    wait instead, so every block is analyzed. A None block marks the end of a finite source. Blocks of multi-channel
+    sources have shape (samples, channels).
+    """
+
+    live = True
+    device_name = None  # names the input device(s) of capture sources, e.g. to store their noise floor
+    overflows = 0  # input overflows reported by the audio input (capture sources count them)
+
+    def __init__(self, block_size, rate=44100, queue_size=16, channels=1):
+        """
+        :param block_size: the number of samples in each block (hop)
+        :param rate: the sample rate of the audio signal
+        :param queue_size: the maximum number of blocks waiting to be read
+        :param channels: the number of channels of each block
+        """
+        self.rate = rate
+        self.block_size = block_size
+        self.channels = channels
+        self.blocks = queue.Queue(queue_size)
+
+        self.dropped_blocks = 0
+
+    def put(self, block, capture_time=None):
+        item = (time.perf_counter() if capture_time is None else capture_time, block)
+        if not self.live:
+            self.blocks.put(item)
+            return
+
+        # latest block wins, drop the oldest one if the consumer is behind
+        while True:
+            try:
+                self.blocks.put_nowait(item)
+                break
+            except queue.Full:
+                try:
+                    self.blocks.get_nowait()
+                    self.dropped_blocks += 1
+                except queue.Empty:
+                    pass
+
+    def read(self, timeout=None):
+        """
+        Returns the next block of audio signal
+
+        :param timeout: the maximum time to wait in seconds (None waits forever)
+        :return: a tuple with the capture time (time.perf_counter) and the block in numpy array format (None at the end
+        of the source), raises queue.Empty on timeout
+        """
+        return self.blocks.get(timeout=timeout)
+
+    def read_nowait(self):
+        """
+        :return: the next block like read, raises queue.Empty if no block is waiting
+        """
+        return self.blocks.get_nowait()
+
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+
+class real_time_audio_capture(audio_source):
+    """
+    Reads real time audio from audio input (microphone) in PyAudio callback mode
+
+    The callback never blocks, input overflows reported by PyAudio and dropped blocks are counted. Multi-channel
+    blocks are the interleaved stream buffer viewed as (samples, channels), so channels are separated without copying.
+    """
+
+    def __init__(self, block_size, rate=44100, queue_size=16, channels=1, device=None):
+        """
+        :param channels: the number of input channels to open
+        :param device: the PyAudio input device index (None for the default input)
+        """
+        super().__init__(block_size, rate, queue_size, channels)
+        self.device = device
+        self.device_name = 'default' if device is None else str(device)
+        self.overflows = 0
+        self.p = None
+        self.stream = None
+
+    def start(self):
+        import pyaudio  # PortAudio is only needed for audio input, not for files or synthetic tones
+
+        self.input_overflow = pyaudio.paInputOverflow
+        self.continue_flag = pyaudio.paContinue
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(format=pyaudio.paFloat32, channels=self.channels, rate=self.rate, input=True,
+                                  input_device_index=self.device, frames_per_buffer=self.block_size,
+                                  stream_callback=self.callback)
+        self.stream.start_stream()
+
+    def callback(self, in_data, frame_count, time_info, status_flags):
+        if status_flags & self.input_overflow:
+            self.overflows += 1
+
+        block = np.frombuffer(in_data, dtype=np.float32)
+        if self.channels > 1:
+            block = block.reshape(-1, self.channels)
+        self.put(block)
+
+        return None, self.continue_flag
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.p is not None:
+            self.p.terminate()
+            self.p = None
+
+
+class generated_audio_source(audio_source):
+    """
+    Base class of the sources whose blocks are produced on a background thread (replay and synthetic sources)
+
+    With real-time pacing blocks are released at the rate a sound card would deliver them, otherwise as fast as the
+    consumer reads them.
+    """
+
+    def __init__(self, block_size, rate=44100, queue_size=16, realtime=True, channels=1):
+        """
+        :param realtime: release blocks at real-time pace (a live source), otherwise as fast as possible
+        """
+        super().__init__(block_size, rate, queue_size, channels)
+        self.live = realtime
+        self.stop_event = threading.Event()
+        self.producer = threading.Thread(target=self.run, name=type(self).__name__, daemon=True)
+
+    def generate_blocks(self):
+        """
+        :return: an iterator of blocks of audio signal in numpy array format
+        """
+        raise NotImplementedError
+
+    def run(self):
+        next_time = time.perf_counter()
+        for block in self.generate_blocks():
+            if self.stop_event.is_set():
+                return
+            if self.live:
+                next_time += len(block) / self.rate
+                self.stop_event.wait(max(0.0, next_time - time.perf_counter()))
+            self.put(block)
+        self.put(None)
+
+    def put(self, block, capture_time=None):
+        if self.live:
+            return super().put(block, capture_time)
+
+        # wait for room in the queue, but give up when stopped
+        item = (time.perf_counter(), block)
+        while not self.stop_event.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def start(self):
+        self.producer.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.producer.is_alive():
+            self.producer.join()
+
+
+class file_audio_source(generated_audio_source):
+    """
+    Replays an audio file as if it was captured from audio input (used on machines without a sound card)
+    """
+
+    def __init__(self, file_name, block_duration=0.05, realtime=True, loop=False, channel=0, queue_size=16):
+        """
+        :param file_name: the name of the audio file to replay
+        :param block_duration: the length of each block in seconds (hop)
+        :param realtime: replay at real-time pace, otherwise as fast as possible
+        :param loop: start again at the end of the file
+        :param channel: the channel to replay, or None to replay all channels
+        :param queue_size: the maximum number of blocks waiting to be read
+        """
+        rate, samples = map_audio_file(file_name)
+        if channel is None and samples.shape[1] == 1:
+            channel = 0  # mono file, replay it as a 1-D signal
+        channels = 1 if channel is not None else samples.shape[1]
+        super().__init__(int(rate * block_duration), rate, queue_size, realtime, channels)
+        self.file_name = file_name
+        self.loop = loop
+        self.channel = channel
+
+    def generate_blocks(self):
+        while True:
+            for _, block in read_audio_file_blocks(self.file_name, self.block_size, self.channel):
+                yield block
+            if not self.loop:
+                return
+
+
+class synthetic_audio_source(generated_audio_source):
+    """
+    Generates a steady tone with harmonics and white noise (used on machines without a sound card)
+
+    Several frequencies generate one tone per channel.
+    """
+
+    def __init__(self, frequency, block_duration=0.05, rate=44100, harmonics=5, noise=0.01, duration=None,
+                 realtime=True, queue_size=16):
+        """
+        :param frequency: the fundamental frequency of the tone, or a list with the frequency of each channel
+        :param block_duration: the length of each block in seconds (hop)
+        :param rate: the sample rate
+        :param harmonics: the number of harmonics (including the fundamental), harmonic h has amplitude 1 / h
+        :param noise: the standard deviation of the added white noise
+        :param duration: the duration of the tone in seconds (None generates forever)
+        :param realtime: generate at real-time pace, otherwise as fast as possible
+        :param queue_size: the maximum number of blocks waiting to be read
+        """
+        channels = 1 if np.isscalar(frequency) else len(frequency)
+        super().__init__(int(rate * block_duration), rate, queue_size, realtime, channels)
+        self.frequency = frequency
+        self.harmonics = harmonics
+        self.noise = noise
+        self.duration = duration
+
+    def generate_blocks(self):
+        rng = np.random.default_rng(0)
+        gains = 0.3 / np.arange(1, self.harmonics + 1)
+        # phase step of each harmonic (rows) of each channel (columns)
+        phase_steps = 2 * np.pi * np.outer(np.arange(1, self.harmonics + 1), np.atleast_1d(self.frequency)) / self.rate
+        position = 0
+        total = None if self.duration is None else int(self.duration * self.rate)
+
+        while total is None or position < total:
+            n = self.block_size if total is None else min(self.block_size, total - position)
+            phases = (position + np.arange(n))[:, None, None] * phase_steps
+            block = np.einsum('shc,h->sc', np.sin(phases), gains) + rng.normal(0, self.noise, (n, self.channels))
+            position += n
+            yield block[:, 0].astype(np.float32) if self.channels == 1 else block.astype(np.float32)
+
+
+class multi_device_capture(audio_source):
+    """
+    Captures several audio input devices together, as one source with the channels of all devices side by side
+
+    Each device runs its own PyAudio stream; a background thread takes one block from every device and joins them, so
+    devices without a shared clock may drift apart by up to a block.
+    """
+
+    def __init__(self, devices, block_size, rate=44100, queue_size=16, channels=1):
+        """
+        :param devices: the PyAudio input device indices
+        :param channels: the number of channels opened on each device
+        """
+        super().__init__(block_size, rate, queue_size, channels * len(devices))
+        self.captures = [real_time_audio_capture(block_size, rate, queue_size, channels, device) for device in devices]
+        self.device_name = '+'.join(capture.device_name for capture in self.captures)
+        self.stop_event = threading.Event()
+        self.joiner = threading.Thread(target=self.run, name='multi_device_capture', daemon=True)
+
+    @property
+    def overflows(self):
+        return sum(capture.overflows for capture in self.captures)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            blocks = []
+            capture_time = None
+            for capture in self.captures:
+                while not self.stop_event.is_set():
+                    try:
+                        block_time, block = capture.read(timeout=0.1)
+                        break
+                    except queue.Empty:
+                        pass
+                else:
+                    return
+                capture_time = block_time if capture_time is None else min(capture_time, block_time)
+                blocks.append(block.reshape(len(block), -1))
+
+            n = min(len(block) for block in blocks)
+            block = np.hstack([block[:n] for block in blocks])
+            self.put(block[:, 0] if self.channels == 1 else block, capture_time)
+
+    def start(self):
+        for capture in self.captures:
+            capture.start()
+        self.joiner.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.joiner.is_alive():
+            self.joiner.join()
+        for capture in self.captures:
+            capture.stop()
+
+
 def plot_audio_signal(signal, sample_rate, samples=None, plot_max_samples=5000, plot_max_freq=1000):
     """
     Plots an audio signal in audio and frequency domain (used for debugging)
@@ -61,6 +635,8 @@ def plot_audio_signal(signal, sample_rate, samples=None, plot_max_samples=5000,
     :param plot_max_freq: the maximum frequency in the frequency spectrum plot
     """
 
+    import matplotlib.pyplot as plt  # only needed for debugging, slow to import
+
     if samples is None:
         samples = len(signal)
 
@@ -85,7 +661,7 @@ def plot_audio_signal(signal, sample_rate, samples=None, plot_max_samples=5000,
     axes[1].grid()
     axes[1].set_xlabel('Frequency (Hz)')
     axes[1].set_ylabel('Amplitude')
-    axes[1].plot(xf, 2.0 / samples * np.abs(yf[0:samples // 2]))
+    axes[1].plot(xf, 2.0 / samples * yf)
 
     fig.tight_layout()
     plt.show()
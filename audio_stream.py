@@ -0,0 +1,134 @@
+import asyncio
+
+
+class subscription:
+    """
+    Asynchronous iterator of the analysis results received by one subscriber of a result_hub
+
+    Results wait in a bounded queue; when the subscriber falls behind the oldest result is dropped, so a slow consumer
+    never stalls capture, analysis or the other subscribers. Iteration ends when the pipeline source ends or the
+    subscription is closed.
+    """
+
+    def __init__(self, hub, queue_size):
+        self.hub = hub
+        self.results = asyncio.Queue(queue_size)
+        self.dropped = 0  # results dropped because the subscriber was behind
+        self.closed = False
+
+    def put(self, result):
+        if self.results.full():
+            self.results.get_nowait()
+            self.dropped += 1
+        self.results.put_nowait(result)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        result = await self.results.get()
+        if result is None:
+            self.closed = True
+            raise StopAsyncIteration
+        return result
+
+    def close(self):
+        """
+        Stops receiving results, a pending iteration ends
+        """
+        if not self.closed:
+            self.hub.unsubscribe(self)
+            self.put(None)
+
+
+class result_hub:
+    """
+    Broadcasts the results of one audio_pipeline to many asyncio subscribers (e.g. a display, a logger and a network
+    publisher), so they share one capture and one analysis per frame
+
+    The pipeline worker thread hands each result to the event loop, which copies it to every subscriber queue.
+    """
+
+    def __init__(self, pipeline, queue_size=8):
+        """
+        :param pipeline: the audio_pipeline producing the results (started and stopped by the hub)
+        :param queue_size: the default number of results kept for each subscriber
+        """
+        self.pipeline = pipeline
+        self.queue_size = queue_size
+        self.subscribers = []
+        self.loop = None
+        self.finished = None
+
+    def subscribe(self, queue_size=None):
+        """
+        :param queue_size: the number of results kept for this subscriber (default: the hub queue_size)
+        :return: a subscription to iterate with async for
+        """
+        subscriber = subscription(self, queue_size or self.queue_size)
+        if self.finished is not None and self.finished.is_set():
+            subscriber.put(None)
+        else:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def publish(self, result):
+        """
+        Copies a result to every subscriber (None ends every subscription), runs on the event loop
+        """
+        for subscriber in list(self.subscribers):
+            subscriber.put(result)
+        if result is None:
+            self.subscribers.clear()
+            self.finished.set()
+
+    def listener(self, result):
+        # called on the pipeline worker thread
+        self.loop.call_soon_threadsafe(self.publish, result)
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.finished = asyncio.Event()
+        self.pipeline.add_listener(self.listener)
+        self.pipeline.start()
+
+    async def stop(self):
+        """
+        Stops the pipeline and ends every subscription
+        """
+        self.pipeline.remove_listener(self.listener)
+        await self.loop.run_in_executor(None, self.pipeline.stop)
+        if not self.finished.is_set():
+            self.publish(None)
+
+    async def wait_finished(self):
+        """
+        Waits until the pipeline source ends (finite sources only, see audio_read.audio_source)
+        """
+        await self.finished.wait()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+
+async def stream_results(pipeline, queue_size=8):
+    """
+    Asynchronous iterator of the results of a pipeline with a single consumer
+
+    :param pipeline: the audio_pipeline producing the results (started and stopped by the iterator)
+    :param queue_size: the number of results kept when the consumer falls behind
+    :return: an asynchronous iterator of analysis_result
+    """
+    async with result_hub(pipeline, queue_size) as hub:
+        async for result in hub.subscribe():
+            yield result
@@ -1,7 +1,423 @@
 import numpy as np
-from scipy.fft import fft, fftfreq
+from scipy.fft import rfft, rfftfreq
+from functools import lru_cache
 import math
 
+from instrumentation import no_stats
+
+notes = ['A', 'A#', 'B', 'C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#']
+
+amplitude_threshold = 1000000  # FFT/HPS note threshold when no energy_gate is calibrated for the input device
+amplitude_threshold_rate = 44100  # the sample rate amplitude_threshold is set for
+min_frequency = 5
+max_frequency = 1500
+note_table_offset = 50  # notes from 49 semitones below to 50 semitones above A4 are considered
+
+
+class spectrum_analyzer:
+    """
+    Reusable FFT/HPS analyzer for frames of a fixed length
+
+    The frequency bins and the window function are computed once and every frame is transformed with a real FFT into
+    preallocated buffers, so repeated analysis of a stream does no per-frame setup work.
+
+    The HPS (Harmonic Product Spectrum) is computed in float32 on the one-sided magnitude spectrum as a sum of log
+    magnitudes (strided views of the spectrum, no copies), only over the searched band.
+    """
+
+    amplitude_threshold = amplitude_threshold
+
+    def __init__(self, sample_rate, samples, window='boxcar', harmonics=4, interpolation=None, zero_padding=1,
+                 min_frequency=None, max_frequency=None):
+        """
+        :param sample_rate: the sample rate of the audio signal
+        :param samples: the number of samples in each frame
+        :param window: the window function applied to each frame (any scipy.signal.get_window name, scaled to a mean of
+        1 so amplitude_threshold holds for every window)
+        :param harmonics: the number of harmonics in the HPS, including the fundamental (amplitude_threshold is set for
+        4, the amplitude grows with each harmonic)
+        :param interpolation: the sub-bin peak refinement ('quadratic', 'gaussian' or None), see interpolate_peaks
+        :param zero_padding: the FFT length as a multiple of the frame length
+        :param min_frequency: the lowest searched fundamental frequency (None searches from 0 Hz)
+        :param max_frequency: the highest searched fundamental frequency (None searches up to the sample rate / (2 *
+        harmonics), above that the highest harmonic is not in the spectrum)
+        """
+        if interpolation not in (None, 'quadratic', 'gaussian'):
+            raise ValueError('Invalid interpolation.')
+        if harmonics < 1:
+            raise ValueError('harmonics must be at least 1.')
+
+        self.sample_rate = sample_rate
+        self.samples = samples
+        self.harmonics = harmonics
+        self.interpolation = interpolation
+        self.fft_size = int(samples * zero_padding)
+
+        # the amplitude grows with the samples per second of the window (harmonics + 1 factors), so lower sample rates
+        # (e.g. decimated input) keep the sensitivity of amplitude_threshold at amplitude_threshold_rate
+        self.amplitude_threshold = amplitude_threshold * (sample_rate / amplitude_threshold_rate) ** (harmonics + 1)
+
+        if window == 'boxcar':
+            self.window = np.ones(samples, dtype=np.float32)
+        else:
+            from scipy.signal import get_window  # scipy.signal is slow to import, only load it when needed
+
+            # the magnitude of a tone is proportional to the sum of the window, so without the scaling the amplitude of a
+            # Hann window would be 2 ** harmonics times lower than the boxcar one amplitude_threshold is set for
+            window = get_window(window, samples, fftbins=True)
+            self.window = (window / np.mean(window)).astype(np.float32)
+        self.xf = rfftfreq(self.fft_size, 1 / sample_rate)  # frequency bins
+
+        # searched bins, every harmonic of the HPS must be in the spectrum
+        bins = len(self.xf)
+        self.search_start = 0 if min_frequency is None else int(np.ceil(min_frequency * self.fft_size / sample_rate))
+        self.search_stop = (bins - 1) // harmonics + 1
+        if max_frequency is not None:
+            self.search_stop = min(self.search_stop, int(max_frequency * self.fft_size / sample_rate) + 1)
+        if self.search_start >= self.search_stop:
+            raise ValueError('Empty search band.')
+        self.log_bins = harmonics * (self.search_stop - 1) + 1  # bins of the highest harmonic of the band
+
+        self.frame = np.zeros(self.fft_size, dtype=np.float32)
+        self.magnitude = np.empty(bins, dtype=np.float32)
+        self.log_magnitude = np.empty(self.log_bins, dtype=np.float32)
+        self.hps = np.empty(self.search_stop - self.search_start, dtype=np.float32)  # log HPS of the searched bins
+
+        self.stats = no_stats  # per-stage timing (see instrumentation.pipeline_stats)
+
+    def harmonic_product(self, log_magnitude, hps):
+        """
+        Sums the log magnitudes of the harmonics of every searched bin into hps (the log Harmonic Product Spectrum)
+
+        :param log_magnitude: the log magnitude spectrum (frames in rows for 2-D arrays), at least log_bins long
+        :param hps: the output array, search_stop - search_start long
+        """
+        start, stop = self.search_start, self.search_stop
+        hps[...] = log_magnitude[..., start:stop]
+        for h in range(2, self.harmonics + 1):
+            hps += log_magnitude[..., h * start:h * (stop - 1) + 1:h]
+
+    def analyze(self, signal):
+        """
+        Analyzes a frame and finds its loudest (fundamental) frequency
+
+        :param signal: the input audio signal in numpy array format (truncated or zero padded to the frame length)
+        :return: a tuple with the loudest frequency and loudest frequency amplitude (product of the harmonic magnitudes)
+        """
+
+        start = self.stats.time()
+
+        # apply window function into the frame buffer
+        n = min(len(signal), self.samples)
+        np.multiply(signal[:n], self.window[:n], out=self.frame[:n])
+        self.frame[n:] = 0
+
+        # perform real Fast Fourier Transform
+        np.abs(rfft(self.frame, overwrite_x=True), out=self.magnitude)
+        start = self.stats.record('fft', start)
+
+        # HPS (Harmonic Product Spectrum)
+        np.maximum(self.magnitude[:self.log_bins], np.finfo(np.float32).tiny, out=self.log_magnitude)
+        np.log(self.log_magnitude, out=self.log_magnitude)
+        self.harmonic_product(self.log_magnitude, self.hps)
+        start = self.stats.record('hps', start)
+
+        # get loudest frequency
+        index = np.argmax(self.hps)
+        peak = self.search_start + index
+        loudest_frequency = self.xf[peak]
+        if self.interpolation is not None:
+            fractional_bin = interpolate_peaks(self.magnitude[np.newaxis], np.array([peak]), self.interpolation)[0]
+            loudest_frequency = fractional_bin * self.sample_rate / self.fft_size
+        self.stats.record('peak', start)
+
+        return loudest_frequency, self.samples * np.exp(np.float64(self.hps[index]))
+
+    def analyze_frames(self, frames):
+        """
+        Analyzes a batch of frames with one FFT/HPS over the 2-D frame matrix
+
+        :param frames: a 2-D numpy array (or strided view) with one frame of length samples per row
+        :return: a tuple with numpy arrays of the loudest frequency and loudest frequency amplitude of each frame
+        """
+
+        # perform real Fast Fourier Transform on all frames
+        magnitude = np.abs(rfft(frames * self.window, n=self.fft_size, axis=-1, overwrite_x=True))
+
+        # HPS (Harmonic Product Spectrum), limited to the searched bins
+        log_magnitude = np.log(np.maximum(magnitude[:, :self.log_bins], np.finfo(magnitude.dtype).tiny))
+        hps = np.empty((len(frames), len(self.hps)), dtype=log_magnitude.dtype)
+        self.harmonic_product(log_magnitude, hps)
+
+        # get loudest frequency of each frame
+        indices = np.argmax(hps, axis=1)
+        peaks = self.search_start + indices
+        loudest_frequency = self.xf[peaks]
+        if self.interpolation is not None:
+            fractional_bins = interpolate_peaks(magnitude, peaks, self.interpolation)
+            loudest_frequency = fractional_bins * self.sample_rate / self.fft_size
+
+        return loudest_frequency, self.samples * np.exp(hps[np.arange(len(hps)), indices].astype(np.float64))
+
+    def analyze_voices(self, signal, voices=6, peaks=48, partials=8, tolerance=25.0, min_salience=0.15,
+                       min_fundamental=0.2, salient_ratio=2.0):
+        """
+        Analyzes a frame with several simultaneous notes (e.g. a strummed chord) and finds up to voices fundamentals
+
+        The spectrum peaks are picked in one vectorized pass and grouped into harmonic series of the candidate
+        fundamentals (the peaks in the searched band). The candidate whose series explains the most peak magnitude
+        (harmonic h weighted 1/h) is taken and the part of its harmonics it explains is removed, limited by the
+        spectral smoothness of its series so that a louder note sharing a harmonic keeps its energy, then the next one
+        is searched in the residual peaks. A harmonic from the 3rd up that stands out as a fundamental of its own is not
+        removed (e.g. E4 on the 4th harmonic of E2 and the 3rd of A2). A note an octave above another one, or one whose
+        own harmonics cancel out with those of the other notes, can still be missed.
+
+        :param signal: the input audio signal in numpy array format (truncated or zero padded to the frame length)
+        :param voices: the maximum number of fundamentals
+        :param peaks: the number of loudest spectrum peaks considered
+        :param partials: the number of harmonics grouped into each series
+        :param tolerance: the maximum offset in cents of a peak from an exact harmonic (strings are slightly
+        inharmonic)
+        :param min_salience: the minimum salience of a fundamental relative to the first one
+        :param min_fundamental: the minimum part of the magnitude of a fundamental peak left unexplained by the notes
+        found before it (lower values find more harmonically related notes, but also more octave errors)
+        :param salient_ratio: how far a harmonic of a found note and its own harmonics 2 to 4 must be above the 1/h
+        envelope of the found note for the harmonic to stay a fundamental candidate
+        :return: a tuple with numpy arrays of the fundamental frequencies (most salient first) and their amplitudes
+        (product of the harmonic magnitudes, as analyze)
+        """
+
+        self.analyze(signal)  # fills magnitude and hps
+
+        # local maxima of the spectrum up to the highest harmonic of the band, refined to fractional bins
+        magnitude = self.magnitude[:self.log_bins]
+        inner = magnitude[1:-1]
+        candidates = np.flatnonzero((inner > magnitude[:-2]) & (inner >= magnitude[2:])) + 1
+        if len(candidates) > peaks:
+            candidates = np.sort(candidates[np.argpartition(magnitude[candidates], -peaks)[-peaks:]])
+        fractional_bins = interpolate_peaks(np.broadcast_to(self.magnitude, (len(candidates), len(self.magnitude))),
+                                            candidates, self.interpolation or 'quadratic')
+        frequency = fractional_bins * self.sample_rate / self.fft_size
+        peak_magnitude = magnitude[candidates].astype(np.float64)
+        residual = peak_magnitude.copy()
+
+        # harmonic number of every peak in the series of every fundamental candidate
+        fundamentals = np.flatnonzero((candidates >= self.search_start) & (candidates < self.search_stop))
+        if not len(fundamentals):
+            return np.empty(0), np.empty(0)
+        ratio = frequency / frequency[fundamentals, np.newaxis]
+        harmonic = np.rint(ratio)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offset = np.abs(1200 * np.log2(ratio / harmonic))
+        weights = np.where((harmonic >= 1) & (harmonic <= partials) & (offset < tolerance),
+                           1 / np.maximum(harmonic, 1), 0)
+        series_index = np.clip(harmonic, 1, partials).astype(int) - 1
+        fundamental_row = np.full(len(candidates), -1)
+        fundamental_row[fundamentals] = np.arange(len(fundamentals))
+
+        found = []
+        first_salience = None
+        for _ in range(min(voices, len(fundamentals))):
+            salience = weights @ residual
+            salience[residual[fundamentals] <= min_fundamental * peak_magnitude[fundamentals]] = 0
+            salience[found] = 0
+            best = int(np.argmax(salience))
+            if salience[best] <= 0 or (first_salience is not None and salience[best] < min_salience * first_salience):
+                break
+            first_salience = first_salience or salience[best]
+            found.append(best)
+
+            # remove the smooth part of the harmonic series (at most the mean of the neighbouring harmonics)
+            members = weights[best] > 0
+            series = np.zeros(partials + 2)
+            np.maximum.at(series, series_index[best, members] + 1, residual[members])
+            smooth = np.minimum(series[1:-1], (series[:-2] + series[1:-1] + series[2:]) / 3)
+            smooth[0] = series[1]  # the fundamental is always explained
+            removed = smooth[series_index[best]] * members
+
+            # a harmonic that is above the 1/h envelope of the series (from its least shared harmonic) with its own
+            # harmonics 2 to 4 is a note of its own and is kept (octaves are too ambiguous, the 2nd harmonic is removed)
+            level = np.min((series[1:-1] * np.arange(1, partials + 1))[series[1:-1] > 0])
+            for member in np.flatnonzero(members & (harmonic[best] >= 3) & (fundamental_row >= 0)):
+                row = fundamental_row[member]
+                own = (weights[row] > 0) & (harmonic[row] >= 2) & (harmonic[row] <= 4)
+                own_series = np.zeros(3)
+                np.maximum.at(own_series, harmonic[row, own].astype(int) - 2, peak_magnitude[own])
+                envelope = salient_ratio * level / (harmonic[best, member] * np.arange(1, 5))
+                if residual[member] > envelope[0] and np.all(own_series > envelope[1:]):
+                    removed[member] = 0
+            residual = np.maximum(residual - removed, 0)
+
+        peaks_found = candidates[fundamentals[found]]
+        return frequency[fundamentals[found]], self.samples * np.exp(
+            self.hps[peaks_found - self.search_start].astype(np.float64))
+
+    def hps_spectrum(self):
+        """
+        Returns the HPS spectrum of the last analyzed frame
+
+        :return: a tuple with numpy arrays of the searched frequency bins and the HPS amplitude of each
+        """
+        return self.xf[self.search_start:self.search_stop], self.samples * np.exp(self.hps.astype(np.float64))
+
+    def frequencies(self):
+        """
+        Returns the HPS spectrum of the last analyzed frame as a dictionary (used for debugging)
+
+        :return: a dictionary with frequencies as keys and amplitudes as values
+        """
+        return dict(zip(*self.hps_spectrum()))
+
+
+class decimator:
+    """
+    Streaming anti-aliased decimation of an audio signal (low-pass FIR filter evaluated only at the kept samples)
+
+    Only every factor-th filter output is computed, as a product of the strided windows of input samples with the
+    filter taps, which is the cost of a polyphase filter. The last input samples and the position of the next output
+    are kept between blocks, so a stream decimated block by block equals the whole signal decimated at once.
+    """
+
+    def __init__(self, sample_rate, factor, taps_per_factor=16, cutoff=0.8):
+        """
+        :param sample_rate: the sample rate of the input signal
+        :param factor: the decimation factor (output sample rate is sample_rate / factor)
+        :param taps_per_factor: the filter length as a multiple of factor (longer filters have steeper edges)
+        :param cutoff: the filter cutoff as a fraction of the output Nyquist frequency
+        """
+        from scipy.signal import firwin  # scipy.signal is slow to import, only load it when needed
+
+        self.factor = factor
+        self.sample_rate = sample_rate / factor
+        self.taps = taps_per_factor * factor + 1
+        # reversed so each output is the dot product of a window of input samples with the filter
+        self.filter = firwin(self.taps, cutoff * self.sample_rate / 2, fs=sample_rate)[::-1].astype(np.float32)
+
+        self.history = None  # the last taps - 1 input samples
+        self.start = 0  # start of the next output window in history + block
+
+    def process(self, block):
+        """
+        Decimates the next block of the stream
+
+        :param block: the input samples in numpy array format (shape (samples, channels) for several channels)
+        :return: the decimated samples as a float32 numpy array (about len(block) / factor samples)
+        """
+        if self.history is None:
+            self.history = np.zeros((self.taps - 1,) + block.shape[1:], dtype=np.float32)
+
+        signal = np.concatenate((self.history, block))
+        stop = len(signal) - self.taps + 1  # windows start before stop
+        if stop <= self.start:
+            output = np.empty((0,) + block.shape[1:], dtype=np.float32)
+        else:
+            windows = np.lib.stride_tricks.sliding_window_view(signal, self.taps, axis=0)[self.start:stop:self.factor]
+            output = windows @ self.filter
+
+        self.start += len(output) * self.factor - (len(signal) - len(self.history))
+        self.history = signal[len(signal) - len(self.history):]
+        return output
+
+    def reset(self):
+        self.history = None
+        self.start = 0
+
+
+class energy_gate:
+    """
+    Skips pitch detection of quiet frames (silence or room noise) from their RMS level
+
+    The level costs one pass over the samples, far less than the FFT/HPS it saves. The threshold is set from the noise
+    floor of the input device (see calibrate), it replaces the amplitude threshold of the detector.
+    """
+
+    def __init__(self, threshold=None):
+        """
+        :param threshold: the frame RMS below which a frame is silent, a number or one per channel (None lets every
+        frame through)
+        """
+        self.threshold = threshold
+
+    @staticmethod
+    def level(frames):
+        """
+        :param frames: a frame, or a 2-D numpy array with one frame per row
+        :return: the RMS level of the frame (a numpy array with one level per row for 2-D input)
+        """
+        return np.sqrt(np.einsum('...i,...i->...', frames, frames) / frames.shape[-1])
+
+    def is_open(self, frames):
+        """
+        :param frames: a frame, or a 2-D numpy array with one frame per row
+        :return: True if the frame is loud enough to analyze (a boolean numpy array for 2-D input)
+        """
+        if self.threshold is None:
+            return np.ones(len(frames), dtype=bool) if np.ndim(frames) == 2 else True
+        return self.level(frames) >= self.threshold
+
+    @staticmethod
+    def calibrate(levels, margin=4.0, min_threshold=1e-4):
+        """
+        Computes a threshold from the levels of frames of noise
+
+        :param levels: the RMS levels of the noise frames (a 2-D numpy array with one column per channel for several
+        channels)
+        :param margin: the threshold as a multiple of the 95th percentile of the noise level
+        :param min_threshold: the lowest threshold (for inputs with digital silence)
+        :return: the threshold (a numpy array with one threshold per channel for 2-D input)
+        """
+        return np.maximum(margin * np.percentile(levels, 95, axis=0), min_threshold)
+
+
+def interpolate_peaks(magnitude, peaks, method='gaussian'):
+    """
+    Refines spectrum peaks to fractional bins by fitting a parabola through each peak bin and its two neighbours
+
+    'quadratic' fits the magnitudes, 'gaussian' fits the log magnitudes (exact for a Gaussian shaped peak and close for
+    the Hann window).
+
+    :param magnitude: a 2-D numpy array with one magnitude spectrum per row
+    :param peaks: a numpy array with the peak bin of each row
+    :param method: the interpolation method ('quadratic' or 'gaussian')
+    :return: a numpy array with the fractional peak bin of each row
+    """
+
+    last = magnitude.shape[-1] - 1
+    inner = (peaks > 0) & (peaks < last)
+    centre = np.clip(peaks, 1, last - 1)
+    rows = np.arange(len(magnitude))
+
+    a = magnitude[rows, centre - 1]
+    b = magnitude[rows, centre]
+    c = magnitude[rows, centre + 1]
+    if method == 'gaussian':
+        tiny = np.finfo(np.float64).tiny
+        a, b, c = np.log(a + tiny), np.log(b + tiny), np.log(c + tiny)
+    elif method != 'quadratic':
+        raise ValueError('Invalid interpolation method.')
+
+    denominator = a - 2 * b + c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = 0.5 * (a - c) / denominator
+    # only refine proper local maxima
+    offset = np.where(inner & (denominator < 0), np.clip(offset, -0.5, 0.5), 0)
+
+    return peaks + offset
+
+
+@lru_cache(maxsize=8)
+def get_spectrum_analyzer(sample_rate, samples, **options):
+    """
+    Returns a cached spectrum analyzer for the given sample rate, frame length and options
+
+    :param sample_rate: the sample rate of the audio signal
+    :param samples: the number of samples in each frame
+    :param options: keyword arguments passed to spectrum_analyzer (window, harmonics, interpolation, zero_padding,
+    min_frequency, max_frequency)
+    :return: a spectrum_analyzer instance
+    """
+    return spectrum_analyzer(sample_rate, samples, **options)
+
 
 def audio_fft(signal, sample_rate, samples=None):
     """
@@ -10,41 +426,43 @@ def audio_fft(signal, sample_rate, samples=None):
     :param signal: the input audio signal in numpy array format
     :param sample_rate: the sample rate of the audio signal
     :param samples: the number of samples to consider
-    :return: a tuple with dictionary with frequencies as keys and amplitudes as values, xf and yf, loudest frequency and
-    loudest frequency amplitude
+    :return: a tuple with dictionary with frequencies as keys and amplitudes as values, xf and yf (HPS spectrum of the
+    searched bins), loudest frequency and loudest frequency amplitude
     """
 
     if samples is None:
         samples = len(signal)  # consider all samples in signal
 
-    # perform Fast Fourier Transform
+    analyzer = get_spectrum_analyzer(sample_rate, samples)
+    loudest_frequency, loudest_frequency_amplitude = analyzer.analyze(signal)
 
-    yf = fft(signal)
-    xf = fftfreq(samples, 1 / sample_rate)[:samples // 2]  # frequency bins
+    xf, hps = analyzer.hps_spectrum()
+    return dict(zip(xf, hps)), xf, hps, loudest_frequency, loudest_frequency_amplitude
 
-    # HPS (Harmonic Power Spectrum)
-    yf_original = yf.copy()
-    hps_steps = 5
-    for i in range(2, hps_steps, 1):
-        yf[:int(np.ceil(len(yf) / i))] *= yf_original[::i]
 
-    # create a dictionary with frequencies and their amplitude
-    frequencies = dict(zip(xf, samples * np.abs(yf[0:samples // 2])))
+def frame_signal(signal, frame_size, hop_size):
+    """
+    Splits an audio signal into overlapping frames without copying
 
-    # get loudest frequency
-    loudest_frequency = max(frequencies, key=frequencies.get)
+    :param signal: the input audio signal in numpy array format
+    :param frame_size: the number of samples in each frame
+    :param hop_size: the number of samples between the starts of consecutive frames
+    :return: a read-only 2-D strided view with one frame per row
+    """
+    if len(signal) < frame_size:
+        return np.empty((0, frame_size), dtype=signal.dtype)
 
-    return frequencies, xf, yf, loudest_frequency, frequencies[loudest_frequency]
+    return np.lib.stride_tricks.sliding_window_view(signal, frame_size)[::hop_size]
 
 
-def frequency_to_note(input_frequency, input_frequency_amplitude, f_0=440.0):
+@lru_cache(maxsize=16)
+def note_table(f_0=440.0):
     """
-    Returns the closest note and it's frequency, given an input frequency
+    Returns the frequencies, names and octaves of the notes considered by frequency_to_note (cached per A4 frequency)
 
-    :param input_frequency: the loudest input frequency (fundamental)
-    :param input_frequency_amplitude: the amplitude of the input frequency
     :param f_0: the frequency of A4 note (default: 440.0)
-    :return: a tuple with closest note frequency and closest note name
+    :return: a tuple with numpy arrays of note frequencies, note names and octaves (as strings), indexed by the number
+    of semitones from A4 plus note_table_offset
     """
 
     # source: http://techlib.com/reference/musical_note_frequencies.htm
@@ -63,32 +481,87 @@ def frequency_to_note(input_frequency, input_frequency_amplitude, f_0=440.0):
     #     'G#': [103.83, 207.66, 415.32, 830.64, 1661.28]
     # }
 
-    notes = ['A', 'A#', 'B', 'C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#']
+    # one extra note on each side so every note has both neighbours
+    n = np.arange(-note_table_offset, note_table_offset + 2)
+    frequencies = f_0 * 2 ** (n / 12)  # source: https://pages.mtu.edu/~suits/NoteFreqCalcs.html
+    names = np.array(notes)[n % 12]
+    octaves = (np.floor((n + 9) / 12).astype(int) + 4).astype(str)
+
+    for table in (frequencies, names, octaves):
+        table.flags.writeable = False
+
+    return frequencies, names, octaves
+
+
+def frequency_to_note_details(input_frequency, input_frequency_amplitude, f_0=440.0, min_amplitude=None):
+    """
+    Returns the closest note, its frequency, the offset from it and the distance to its neighbour note, given input
+    frequencies
+
+    Works on single values and on numpy arrays (e.g. a whole pitch track) in one vectorized pass.
+
+    :param input_frequency: the loudest input frequency (fundamental), a number or numpy array
+    :param input_frequency_amplitude: the amplitude of the input frequency, a number or numpy array
+    :param f_0: the frequency of A4 note (default: 440.0)
+    :param min_amplitude: the minimum amplitude of a note (default: amplitude_threshold, for the FFT/HPS detector)
+    :return: a tuple with closest note frequency, closest note name, octave, cents offset from the closest note and
+    frequency distance between the closest note and the second closest note (None for single values or nan/'' for
+    arrays if no note was detected)
+    """
+
+    if min_amplitude is None:
+        min_amplitude = amplitude_threshold
+
+    if np.ndim(input_frequency) == 0:
+        # single value, avoid numpy overhead
+        if input_frequency <= min_frequency or input_frequency >= max_frequency or \
+                input_frequency_amplitude < min_amplitude:
+            return None, None, None, None, None
+
+        semitones = 12 * math.log2(input_frequency / f_0)
+        closest = min(max(round(semitones), 1 - note_table_offset), note_table_offset)
+        closest_frequency = f_0 * 2 ** (closest / 12)
+        cents = 100 * (semitones - closest)
+        neighbour = f_0 * 2 ** ((closest - 1 if cents < 0 else closest + 1) / 12)
+
+        return closest_frequency, notes[closest % 12], str((closest + 9) // 12 + 4), cents, \
+            abs(neighbour - closest_frequency)
+
+    frequency = np.asarray(input_frequency, dtype=np.float64)
+    amplitude = np.asarray(input_frequency_amplitude)
+    frequencies, names, octaves = note_table(float(f_0))
 
-    amplitude_threshold = 1000000  # TODO: play with threshold on different devices
-    min_frequency = 5
-    max_frequency = 1500
+    voiced = (frequency > min_frequency) & (frequency < max_frequency) & (amplitude >= min_amplitude)
 
-    if input_frequency <= min_frequency or input_frequency >= max_frequency or \
-            input_frequency_amplitude < amplitude_threshold:
-        return None, None, None
+    # closest note in closed form: round(12 * log2(f / f_0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        semitones = 12 * np.log2(np.where(voiced, frequency, f_0) / f_0)
+    closest = np.clip(np.round(semitones).astype(int), 1 - note_table_offset, note_table_offset)
+    index = closest + note_table_offset
 
-    closest_frequency = None
-    closest_note = None
-    octave = None
+    cents = 100 * (semitones - closest)
+    neighbour = np.where(cents < 0, frequencies[index - 1], frequencies[index + 1])
+    distance = np.abs(neighbour - frequencies[index])
 
-    a = 2 ** (1 / 12)
+    return (np.where(voiced, frequencies[index], np.nan), np.where(voiced, names[index], ''),
+            np.where(voiced, octaves[index], ''), np.where(voiced, cents, np.nan), np.where(voiced, distance, np.nan))
 
-    # iterate notes and find the closest one
-    for n in range(-50, 50):
-        frequency = f_0 * a ** (n + 1)  # source: https://pages.mtu.edu/~suits/NoteFreqCalcs.html
 
-        if closest_frequency is None or abs(input_frequency - frequency) < abs(input_frequency - closest_frequency):
-            closest_frequency = frequency
-            closest_note = notes[(n + 1) % 12]
-            octave = math.floor((n + 10) / 12) + 4
+def frequency_to_note(input_frequency, input_frequency_amplitude, f_0=440.0, min_amplitude=None):
+    """
+    Returns the closest note and it's frequency, given an input frequency
 
-    return closest_frequency, closest_note, str(octave)
+    :param input_frequency: the loudest input frequency (fundamental), a number or numpy array
+    :param input_frequency_amplitude: the amplitude of the input frequency
+    :param f_0: the frequency of A4 note (default: 440.0)
+    :param min_amplitude: the minimum amplitude of a note (default: amplitude_threshold, for the FFT/HPS detector)
+    :return: a tuple with closest note frequency, closest note name and octave
+    """
+
+    closest_frequency, closest_note, octave, _, _ = frequency_to_note_details(input_frequency,
+                                                                              input_frequency_amplitude, f_0,
+                                                                              min_amplitude)
+    return closest_frequency, closest_note, octave
 
 
 def neighbour_note_frequency(note_frequency, frequency, f_0=440.0):
@@ -100,14 +573,12 @@ def neighbour_note_frequency(note_frequency, frequency, f_0=440.0):
     :param f_0: the frequency of A4 note (default: 440.0)
     :return: returns the frequency of the second closest note
     """
-    a = 2 ** (1 / 12)
-
-    n = math.log(note_frequency / f_0, a)
+    n = round(12 * math.log2(note_frequency / f_0))
 
     if frequency > note_frequency:
-        return f_0 * a ** (n + 1)
+        return f_0 * 2 ** ((n + 1) / 12)
     elif frequency < note_frequency:
-        return f_0 * a ** (n - 1)
+        return f_0 * 2 ** ((n - 1) / 12)
 
     return None
 
@@ -0,0 +1,174 @@
+import glob
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from audio_read import map_audio_file, file_pitch_track
+
+track_columns = ['time', 'frequency', 'note', 'cents', 'amplitude']
+warmup_duration = 10  # seconds of frames analyzed (and dropped) before each chunk, so stateful detectors join up
+
+
+def find_audio_files(paths):
+    """
+    Expands directories and glob patterns into a sorted list of Wave files
+
+    :param paths: file names, directories (searched recursively) or glob patterns
+    :return: the list of file names
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, '**', '*.wav'), recursive=True))
+        elif glob.has_magic(path):
+            files.update(f for f in glob.glob(path, recursive=True) if f.endswith('.wav'))
+        else:
+            files.add(path)
+    return sorted(files)
+
+
+def plan_tasks(files, window, hop, chunk_duration):
+    """
+    Splits files into tasks of at most chunk_duration seconds of frames, so long files are spread across workers
+
+    :return: a list of (file name, start sample, stop sample) tuples, chunks are a multiple of the hop long
+    """
+    tasks = []
+    for file_name in files:
+        sample_rate, samples = map_audio_file(file_name)
+        hop_size = int(sample_rate * hop)
+        chunk_size = max(1, int(sample_rate * chunk_duration) // hop_size) * hop_size
+        last_start = len(samples) - int(sample_rate * window)  # the last position a frame can start at
+
+        for start in range(0, max(last_start, 0) + 1, chunk_size):
+            tasks.append((file_name, start, start + chunk_size))
+    return tasks
+
+
+def analyze_task(task, window, hop, f_0, analyzer_options):
+    """
+    Computes the pitch track of one task (runs in a worker process)
+
+    Chunks after the first start warmup_duration early and drop those frames, so a detector that follows notes from
+    frame to frame (the note held by YIN and McLeod) enters the chunk in the state of a single pass over the file.
+    """
+    file_name, start, stop = task
+    sample_rate, _ = map_audio_file(file_name)
+    hop_size = int(sample_rate * hop)
+    warmup = min(start // hop_size, int(warmup_duration / hop))  # frames
+    track = file_pitch_track(file_name, window, hop, f_0, analyzer_options=analyzer_options,
+                             start=start - warmup * hop_size, stop=stop)
+    return task, tuple(column[warmup:] for column in track)
+
+
+def file_duration(file_name):
+    """
+    :return: the length of a Wave file in seconds (read from its header, the samples are only mapped)
+    """
+    sample_rate, samples = map_audio_file(file_name)
+    return len(samples) / sample_rate
+
+
+def track_summary(track, duration):
+    """
+    :param track: a tuple with the time, frequency, note, cents and amplitude arrays of a file
+    :param duration: the length of the file in seconds (the frames stop a window before its end)
+    :return: a dictionary with the duration, number of frames, ratio of frames with a note, median absolute cents
+    offset and the most common note
+    """
+    time, _, note, cents, _ = track
+    voiced = note != ''
+    notes = Counter(note[voiced])
+
+    return {
+        'duration': duration,
+        'frames': len(time),
+        'voiced_ratio': voiced.mean() if len(time) else 0.0,
+        'median_abs_cents': np.median(np.abs(cents[voiced])) if voiced.any() else np.nan,
+        'main_note': notes.most_common(1)[0][0] if notes else '',
+    }
+
+
+def batch_pitch_track(paths, window=1, hop=0.05, f_0=440.0, workers=None, chunk_duration=300,
+                      analyzer_options=None, progress=True, cache=None):
+    """
+    Computes the pitch tracks of many recordings, spreading files and chunks of long files across a process pool
+
+    :param paths: file names, directories or glob patterns of Wave files
+    :param window: the length of the analysis window in seconds
+    :param hop: the time between consecutive windows in seconds
+    :param f_0: the frequency of A4 note (default: 440.0)
+    :param workers: the number of worker processes (default: number of CPUs)
+    :param chunk_duration: the maximum duration in seconds analyzed by one task
+    :param analyzer_options: keyword arguments for the pitch detector (see pitch_detection.get_pitch_detector)
+    :param progress: print a progress indicator to stderr
+    :param cache: an analysis_cache.analysis_cache, files analyzed before with the same parameters are loaded from it
+    and only the others are analyzed (and stored in it)
+    :return: a dictionary of file name to pitch track tuple (time, frequency, note, cents, amplitude)
+    """
+    files = find_audio_files(paths)
+    cached = {}
+    keys = {}
+    if cache is not None:
+        for file_name in files:
+            keys[file_name] = cache.key(file_name, window, hop, f_0, analyzer_options=analyzer_options)
+            track = cache.load(keys[file_name])
+            if track is not None:
+                cached[file_name] = track
+
+    tasks = plan_tasks([file_name for file_name in files if file_name not in cached], window, hop, chunk_duration)
+    chunks = {file_name: {} for file_name in files if file_name not in cached}
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(analyze_task, task, window, hop, f_0, analyzer_options) for task in tasks]
+        for done, future in enumerate(as_completed(futures), 1):
+            (file_name, start, _), track = future.result()
+            chunks[file_name][start] = track
+            if progress:
+                print('\r[{}/{}] {:.0%}'.format(done, len(tasks), done / len(tasks)), end='', file=sys.stderr)
+    if progress and tasks:
+        print(file=sys.stderr)
+
+    # join the chunks of each file in order
+    tracks = {}
+    for file_name in files:
+        if file_name in cached:
+            tracks[file_name] = cached[file_name]
+            continue
+
+        ordered = [chunks[file_name][start] for start in sorted(chunks[file_name])]
+        if ordered:
+            tracks[file_name] = tuple(np.concatenate(column) for column in zip(*ordered))
+        else:
+            tracks[file_name] = (np.empty(0), np.empty(0), np.empty(0, dtype=str), np.empty(0), np.empty(0))
+        if cache is not None:
+            cache.store(keys[file_name], tracks[file_name])
+
+    if cache is not None:
+        cache.save()
+    return tracks
+
+
+def save_batch(tracks, output):
+    """
+    Saves pitch tracks and their summary to one .npz file
+
+    Track arrays are stored as 'track_<i>_<column>' for the i-th entry of 'files'; the summary is stored column-wise
+    as 'summary_<field>' arrays aligned with 'files'.
+
+    :param tracks: a dictionary of file name to pitch track tuple
+    :param output: the output file name
+    """
+    arrays = {'files': np.array(list(tracks), dtype=str)}
+    summaries = [track_summary(track, file_duration(file_name)) for file_name, track in tracks.items()]
+
+    for i, track in enumerate(tracks.values()):
+        for column, values in zip(track_columns, track):
+            arrays['track_{}_{}'.format(i, column)] = values
+    for field in ['duration', 'frames', 'voiced_ratio', 'median_abs_cents', 'main_note']:
+        arrays['summary_' + field] = np.array([summary[field] for summary in summaries])
+
+    np.savez(output, **arrays)
@@ -0,0 +1,293 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from audio_read import ring_buffer, read_audio_file_blocks
+from audio_utils import audio_fft, frame_signal, frequency_to_note_details, note_table, note_table_offset, notes
+from pitch_detection import create_pitch_detector, pitch_detectors, pitch_track
+from session_recorder import load_session
+
+# expected notes of the recordings in audio_samples (standard guitar tuning)
+sample_notes = {
+    'audio_samples/Guitar-E.wav': 'E4',
+    'audio_samples/Guitar-A.wav': 'A2',
+    'audio_samples/Guitar-D.wav': 'D3',
+    'audio_samples/Guitar-G.wav': 'G3',
+    'audio_samples/Guitar-B.wav': 'B3',
+}
+
+# open guitar strings, detuned so they do not fall on FFT bin centres
+synthetic_notes = ['E2', 'A2', 'D3', 'G3', 'B3', 'E4']
+synthetic_detune = 13  # cents
+
+# highest ratio of voiced frames with a wrong note or octave before a case counts as a regression (e.g. a detector
+# reading the 3rd harmonic of the decaying Guitar-A recording)
+max_wrong_note = 0.15
+
+
+def note_frequency(note, f_0=440.0):
+    """
+    Returns the frequency of a note name with octave (e.g. 'A#3')
+
+    :param note: the note name with octave
+    :param f_0: the frequency of A4 note (default: 440.0)
+    :return: the frequency of the note
+    """
+    name, octave = note[:-1], int(note[-1])
+    semitones = notes.index(name) + 12 * (octave - 4) - (12 if notes.index(name) >= 3 else 0)
+    return note_table(f_0)[0][semitones + note_table_offset]
+
+
+def synthetic_tone(frequency, duration, sample_rate=44100, harmonics=5, noise=0.01, seed=0):
+    """
+    Generates a decaying tone with harmonics and white noise (used as ground truth)
+
+    :param frequency: the fundamental frequency
+    :param duration: the duration in seconds
+    :param sample_rate: the sample rate
+    :param harmonics: the number of harmonics (including the fundamental), harmonic h has amplitude 1 / h
+    :param noise: the standard deviation of the added white noise
+    :param seed: the random seed for the noise and harmonic phases
+    :return: the tone as a float32 numpy array
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+
+    signal = np.zeros(len(t))
+    for h in range(1, harmonics + 1):
+        signal += np.sin(2 * np.pi * frequency * h * t + rng.uniform(0, 2 * np.pi)) / h
+    signal *= 0.3 * np.exp(-t / duration)
+    signal += rng.normal(0, noise, len(t))
+
+    return signal.astype(np.float32)
+
+
+def latency_summary(timings):
+    """
+    :param timings: per-frame durations in seconds
+    :return: a dictionary with latency percentiles in milliseconds and frames per second
+    """
+    timings = np.asarray(timings)
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99]) * 1000
+    return {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'fps': len(timings) / timings.sum()}
+
+
+def accuracy_summary(frequencies, expected_frequency):
+    """
+    :param frequencies: the detected frequency of each frame (nan or 0 for frames without a note)
+    :param expected_frequency: the ground truth frequency
+    :return: a dictionary with the ratio of frames with a note and their pitch error in cents
+    """
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    voiced = frequencies > 0
+    errors = np.abs(1200 * np.log2(frequencies[voiced] / expected_frequency))
+    if len(errors) == 0:
+        return {'voiced_ratio': 0.0}
+
+    return {
+        'voiced_ratio': voiced.mean(),
+        'median_cents': np.median(errors),
+        'p95_cents': np.percentile(errors, 95),
+        'within_5_cents': np.mean(errors <= 5),
+        'gross_error_ratio': np.mean(errors > 50),  # wrong note or octave
+    }
+
+
+def time_calls(function, items):
+    timings = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_pipeline(signal, sample_rate, window, hop, analyzer_options, f_0=440.0):
+    """
+    Runs the headless pipeline (ring buffer, pitch detector and note mapping) over a signal, hop by hop
+
+    :return: a tuple with the per-frame durations and the detected frequency of each frame (nan without a note)
+    """
+    buffer = ring_buffer(int(sample_rate * window))
+    hop_size = int(sample_rate * hop)
+    analyzer = create_pitch_detector(sample_rate, buffer.size, **analyzer_options)  # no state of other runs
+
+    timings = []
+    frequencies = []
+    for start in range(0, len(signal) - hop_size + 1, hop_size):
+        begin = time.perf_counter()
+        buffer.write(signal[start:start + hop_size])
+        if not buffer.full():
+            continue
+        frequency, amplitude = analyzer.analyze(buffer.window())
+        closest_frequency, _, _, _, _ = frequency_to_note_details(frequency, amplitude, f_0,
+                                                                  analyzer.amplitude_threshold)
+        timings.append(time.perf_counter() - begin)
+        frequencies.append(frequency if closest_frequency is not None else np.nan)
+
+    return timings, frequencies
+
+
+def run_case(name, signal, sample_rate, expected_frequency, window, hop, analyzer_options, max_frames):
+    """
+    Benchmarks every analysis path on one signal
+
+    :return: a dictionary with the results of the case
+    """
+    frame_size = int(sample_rate * window)
+    frames = frame_signal(signal, frame_size, int(sample_rate * hop))[:max_frames]
+    signal = signal[:frame_size + (len(frames) - 1) * int(sample_rate * hop)]
+    analyzer = create_pitch_detector(sample_rate, frame_size, **analyzer_options)
+    detections = [analyzer.analyze(frame) for frame in frames]
+
+    stages = {
+        'detector': latency_summary(time_calls(analyzer.analyze, frames)),
+        'frequency_to_note': latency_summary(time_calls(
+            lambda detection: frequency_to_note_details(*detection, 440.0, analyzer.amplitude_threshold),
+            detections)),
+    }
+    if analyzer_options.get('detector', 'hps') == 'hps':
+        stages['audio_fft'] = latency_summary(time_calls(lambda frame: audio_fft(frame, sample_rate), frames))
+
+    pipeline_timings, pipeline_frequencies = run_pipeline(signal, sample_rate, window, hop, analyzer_options)
+    stages['pipeline'] = latency_summary(pipeline_timings)
+
+    # batched offline analysis
+    start = time.perf_counter()
+    pitch_track(signal, sample_rate, window, hop, analyzer_options=analyzer_options)
+    batch_time = time.perf_counter() - start
+
+    # memory of the streaming pipeline
+    tracemalloc.start()
+    run_pipeline(signal[:frame_size * 4], sample_rate, window, hop, analyzer_options)
+    _, memory_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'case': name,
+        'detector': analyzer_options.get('detector', 'hps'),
+        'expected_frequency': expected_frequency,
+        'frames': len(frames),
+        'stages': stages,
+        'batch': {'fps': len(frames) / batch_time, 'realtime_factor': len(signal) / sample_rate / batch_time},
+        'memory_peak_kb': memory_peak / 1024,
+        'accuracy': accuracy_summary(pipeline_frequencies, expected_frequency),
+    }
+
+
+def run_session(prefix, window, hop, analyzer_options):
+    """
+    Replays a recorded session (see session_recorder) through the pipeline and compares the results with the recorded
+    ones (the first channel, use the window and hop of the session)
+
+    :return: a dictionary with the results of the session
+    """
+    audio_file, recorded = load_session(prefix)
+    sample_rate, signal = next(read_audio_file_blocks(audio_file, block_size=1 << 30), (None, None))
+    if signal is None:
+        return {'session': prefix, 'frames': 0}
+
+    timings, frequencies = run_pipeline(signal, sample_rate, window, hop, analyzer_options)
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+
+    # the recorded result at time t is the window ending t seconds into the recording
+    rows = recorded['channel'] == 0 if 'channel' in recorded else slice(None)
+    frames = np.round((recorded['time'][rows] - window) / hop).astype(int)
+    valid = (frames >= 0) & (frames < len(frequencies))
+    replayed = frequencies[frames[valid]]
+    recorded_frequency = np.where(recorded['note'][rows][valid] != '', recorded['frequency'][rows][valid], np.nan)
+
+    both = ~np.isnan(replayed) & ~np.isnan(recorded_frequency)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        difference = np.abs(1200 * np.log2(replayed[both] / recorded_frequency[both]))
+
+    return {
+        'session': prefix,
+        'detector': analyzer_options.get('detector', 'hps'),
+        'frames': int(valid.sum()),
+        'pipeline': latency_summary(timings) if timings else {},
+        'voicing_agreement': float(np.mean(np.isnan(replayed) == np.isnan(recorded_frequency))) if valid.any() else 0.0,
+        'note_agreement': float(np.mean(difference < 50)) if both.any() else 0.0,
+        'median_cents_difference': float(np.median(difference)) if both.any() else np.nan,
+    }
+
+
+def main_benchmark(detectors, window=0.5, hop=0.05, noise=0.01, max_frames=200, output='benchmark.json', sessions=(),
+                   max_wrong_note=max_wrong_note):
+    """
+    :return: the names and detectors of the cases with a higher ratio of wrong notes or octaves than max_wrong_note
+    """
+    cases = []
+    for file_name, note in sample_notes.items():
+        for sample_rate, signal in read_audio_file_blocks(file_name, block_size=1 << 30):
+            cases.append((file_name, signal, sample_rate, note_frequency(note)))
+    for note in synthetic_notes:
+        frequency = note_frequency(note) * 2 ** (synthetic_detune / 1200)
+        cases.append(('synthetic ' + note, synthetic_tone(frequency, 4, noise=noise), 44100, frequency))
+
+    results = []
+    regressions = []
+    for detector in detectors:
+        for name, signal, sample_rate, expected_frequency in cases:
+            result = run_case(name, signal, sample_rate, expected_frequency, window, hop, {'detector': detector},
+                              max_frames)
+            results.append(result)
+
+            accuracy = result['accuracy']
+            print('{:<30} {:<4} pipeline p50 {:6.2f} ms p99 {:6.2f} ms {:7.0f} fps | voiced {:4.0%} median {} cents, '
+                  'wrong note or octave {}'
+                  .format(name, detector, result['stages']['pipeline']['p50_ms'],
+                          result['stages']['pipeline']['p99_ms'], result['stages']['pipeline']['fps'],
+                          accuracy['voiced_ratio'],
+                          '{:.1f}'.format(accuracy['median_cents']) if 'median_cents' in accuracy else '-',
+                          '{:4.0%}'.format(accuracy['gross_error_ratio']) if 'gross_error_ratio' in accuracy else '-'))
+            if accuracy.get('gross_error_ratio', 0) > max_wrong_note:
+                regressions.append((name, detector))
+
+    session_results = []
+    for detector in detectors:
+        for prefix in sessions:
+            result = run_session(prefix, window, hop, {'detector': detector})
+            session_results.append(result)
+            if result['frames']:
+                print('{:<30} {:<4} pipeline p50 {:6.2f} ms | voicing agreement {:4.0%} note agreement {:4.0%}'.format(
+                    prefix, detector, result['pipeline'].get('p50_ms', np.nan), result['voicing_agreement'],
+                    result['note_agreement']))
+
+    report = {
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'settings': {'window': window, 'hop': hop, 'noise': noise, 'max_frames': max_frames},
+        'results': results,
+        'sessions': session_results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, default=float)
+
+    for name, detector in regressions:
+        print('Regression: {} {} has more than {:.0%} wrong notes or octaves'.format(name, detector, max_wrong_note))
+    return regressions
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Measure speed and accuracy of the analysis paths')
+    arg_parser.add_argument('-detectors', nargs='+', choices=list(pitch_detectors), default=list(pitch_detectors))
+    arg_parser.add_argument('-window', type=float, default=0.5, help='Analysis window length in seconds')
+    arg_parser.add_argument('-hop', type=float, default=0.05, help='Time between analysis windows in seconds')
+    arg_parser.add_argument('-noise', type=float, default=0.01, help='Noise level of the synthetic tones')
+    arg_parser.add_argument('-max_frames', type=int, default=200, help='Maximum frames timed per case')
+    arg_parser.add_argument('-o', dest='output', default='benchmark.json', help='Output JSON file')
+    arg_parser.add_argument('-sessions', nargs='+', default=(), metavar='PREFIX',
+                            help='Also replay sessions recorded with main.py -record and compare with their results')
+    arg_parser.add_argument('-max_wrong_note', type=float, default=max_wrong_note,
+                            help='Exit with status 1 if a case has a higher ratio of wrong notes or octaves')
+    args = arg_parser.parse_args()
+
+    if main_benchmark(args.detectors, args.window, args.hop, args.noise, args.max_frames, args.output, args.sessions,
+                      args.max_wrong_note):
+        sys.exit(1)
@@ -1,60 +1,195 @@
+import configparser
+import hashlib
+import io
+import os
 import tkinter as tk
-from PIL import ImageTk, Image
+import tkinter.font
 import winsound
-import pyglet
-from configparser import ConfigParser
 
-from audio_read import read_real_time_audio
-from audio_utils import audio_fft, frequency_to_note, neighbour_note_frequency
+import numpy as np
 
-pyglet.font.add_file('Assets/LcdSolid-VPzB.ttf')
+from audio_pipeline import audio_pipeline, multi_result, gate_settings_key, format_gate_threshold, parse_gate_threshold, \
+    settings_file
+from instrumentation import pipeline_stats, no_stats
 
+font_file = 'Assets/LcdSolid-VPzB.ttf'
+font_family = 'LCD Solid'
+image_cache_dir = '.cache/images'
+
+
+def load_font(root):
+    # registering the font through pyglet is slow, skip it when the font is already available (e.g. installed)
+    if font_family not in tkinter.font.families(root):
+        import pyglet
+
+        pyglet.font.add_file(font_file)
+
+
+def scale_image(path, scaling_factor=1, scaling_method=None, resample=None):
+    from PIL import ImageTk, Image  # only needed when the scaled image is not cached
 
-def open_image(path, scaling_factor=1, scaling_method=None, resample=None):
-    if scaling_method == None:
-        image = ImageTk.PhotoImage(file=path)
     if scaling_method == 'resize':
         image = Image.open(path)
         image = image.resize((int(image.width * scaling_factor), int(image.height * scaling_factor)),
-                             resample)
-        image = ImageTk.PhotoImage(image)
+                             getattr(Image, resample.upper()) if resample else None)
+        return image, ImageTk.PhotoImage(image)
     elif scaling_method == 'subsample':
         image = ImageTk.PhotoImage(file=path)
         image = image._PhotoImage__photo.subsample(int(scaling_factor))
+        return None, image
     else:
         raise ValueError('Invalid scaling_method.')
-    return image
+
+
+def open_image(path, scaling_factor=1, scaling_method=None, resample=None):
+    """
+    Opens and scales an image, scaled images are cached on disk and loaded by Tk directly on the next launches
+
+    :param path: the image file
+    :param scaling_factor: the scale factor (an integer for subsample)
+    :param scaling_method: 'resize' (through PIL) or 'subsample' (keep every scaling_factor-th pixel)
+    :param resample: the PIL resampling filter name for resize (e.g. 'nearest')
+    :return: the scaled image, usable as a Tk widget image
+    """
+    key = '{}|{}|{}|{}|{}'.format(os.path.abspath(path), scaling_factor, scaling_method, resample,
+                                  os.stat(path).st_mtime_ns)
+    cache_path = os.path.join(image_cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.png')
+    if os.path.exists(cache_path):
+        try:
+            return tk.PhotoImage(file=cache_path)
+        except tk.TclError:
+            pass  # unreadable cache entry, scale again
+
+    image, photo = scale_image(path, scaling_factor, scaling_method, resample)
+    try:
+        os.makedirs(image_cache_dir, exist_ok=True)
+        if image is not None:
+            image.save(cache_path)
+        else:
+            photo.write(cache_path, format='png')
+    except (OSError, tk.TclError):
+        pass  # the cache is optional (e.g. read-only directory)
+    return photo
+
+
+class widget_renderer:
+    """
+    Keeps the options last displayed by each widget and only sends Tk configure calls for options that changed
+
+    Updates are collected with set and sent together by flush, so a widget changed several times between two frames
+    (e.g. an indicator cleared and lit again) is configured at most once, and not at all if it ends up unchanged.
+    """
+
+    def __init__(self):
+        self.displayed = {}  # widget to the options it shows
+        self.pending = {}  # widget to the options to show on the next flush
+        self.configure_calls = 0
+
+    def set(self, widget, **options):
+        self.pending.setdefault(widget, {}).update(options)
+
+    def flush(self):
+        for widget, options in self.pending.items():
+            displayed = self.displayed.setdefault(widget, {})
+            changed = {option: value for option, value in options.items()
+                       if option not in displayed or displayed[option] != value}
+            if changed:
+                widget.configure(**changed)
+                displayed.update(changed)
+                self.configure_calls += 1
+        self.pending.clear()
+
+
+class spectrogram_view:
+    """
+    Scrolling spectrogram with the harmonics of the detected note marked, drawn into a Tk PhotoImage
+
+    Columns are written into a preallocated ring image (one column per analyzed window, no re-plotting), draw sends the
+    whole image to Tk as a binary PPM once per display frame and only if columns were added.
+    """
+
+    # colour map anchors from silent to loud (black, purple, orange, pale yellow)
+    colormap_anchors = np.array([[0, 0, 0], [90, 20, 110], [230, 90, 30], [255, 250, 180]])
+
+    def __init__(self, master, frequencies, width=400, dynamic_range=60, harmonics=4):
+        """
+        :param master: the parent widget
+        :param frequencies: the frequency of each row, lowest first (see audio_pipeline.enable_spectrogram)
+        :param width: the number of columns shown
+        :param dynamic_range: the range of levels shown in dB below the recent peak level
+        :param harmonics: the number of harmonics of the detected note to mark
+        """
+        self.log_frequencies = np.log(frequencies)
+        self.height = len(frequencies)
+        self.width = width
+        self.log_range = dynamic_range / 20 * np.log(10)  # in natural log of magnitude
+        self.harmonics = np.arange(1, harmonics + 1)
+
+        position = np.linspace(0, len(self.colormap_anchors) - 1, 256)
+        self.colormap = np.stack([np.interp(position, np.arange(len(self.colormap_anchors)), channel)
+                                  for channel in self.colormap_anchors.T], axis=1).astype(np.uint8)
+
+        self.image = np.zeros((self.height, width, 3), dtype=np.uint8)  # ring of columns, top row is the highest
+        self.column = 0  # the next column to write (the oldest one)
+        self.peak = None  # the recent peak level, decays slowly
+        self.changed = True
+        self.header = 'P6 {} {} 255 '.format(width, self.height).encode()
+
+        self.photo = tk.PhotoImage(width=width, height=self.height)
+        self.label = tk.Label(master, image=self.photo, bd=0)
+
+    def add_column(self, log_magnitude, result=None):
+        """
+        :param log_magnitude: the log magnitude of each row
+        :param result: the analysis_result of the column (its harmonics are marked if a note was detected), or a
+        multi_result of them for polyphonic analysis
+        """
+        level = float(log_magnitude.max())
+        self.peak = level if self.peak is None else max(level, self.peak - 0.05)
+        levels = (log_magnitude - (self.peak - self.log_range)) * (255 / self.log_range)
+        column = self.colormap[np.clip(levels, 0, 255).astype(np.uint8)][::-1]
+
+        results = result if isinstance(result, multi_result) else (result,)
+        for result in results:
+            if result is None or result.note is None:
+                continue
+            rows = np.round(np.interp(np.log(result.frequency * self.harmonics), self.log_frequencies,
+                                      np.arange(self.height), left=-1, right=-1)).astype(int)
+            in_tune = abs(result.frequency - result.closest_frequency) <= 0.5
+            column[self.height - 1 - rows[rows >= 0]] = (0, 255, 27) if in_tune else (255, 255, 255)
+
+        self.image[:, self.column] = column
+        self.column = (self.column + 1) % self.width
+        self.changed = True
+
+    def draw(self):
+        if not self.changed:
+            return
+        # oldest column on the left
+        image = np.concatenate((self.image[:, self.column:], self.image[:, :self.column]), axis=1)
+        self.photo.configure(data=self.header + image.tobytes(), format='PPM')
+        self.changed = False
 
 
 class main_window(tk.Tk):
     def __init__(self):
         super().__init__()
+        load_font(self)
 
-        # App settings
+        # App settings, missing options fall back to the defaults and the other sections (e.g. the [gate] thresholds
+        # written by headless mode, which may be all the file holds) are kept; the file is written on exit if changed
+        self.config = configparser.ConfigParser()
         try:
-            self.config = ConfigParser()
-            with open('settings.ini') as f:
+            with open(settings_file) as f:
                 self.config.read_file(f)
-            if not self.config.has_option('sound', 'sound_on') or \
-                    not self.config.has_option('color', 'color_mode') or \
-                    not self.config.has_option('a4_tuning', 'frequency') or \
-                    not self.config.has_option('window', 'geometry') or \
-                    not self.config.has_option('window', 'zoomed'):
-                raise ValueError('Configuration file has missing options.')
-        except:
-            self.config = ConfigParser()
-            self.config['sound'] = {'sound_on': 'True'}
-            self.config['color'] = {'color_mode': 'light'}
-            self.config['a4_tuning'] = {'frequency': '440'}
-            self.config['window'] = {'geometry': '550x400',
-                                     'zoomed': 'False'}
-            with open('settings.ini', 'w') as configfile:
-                self.config.write(configfile)
-        self.config.read('setting.ini')
-        self.sound_on = self.config.getboolean('sound', 'sound_on')
-        self.color_mode = self.config['color']['color_mode']
-        self.geometry(self.config['window']['geometry'])
-        if self.config.getboolean('window', 'zoomed') == True:
+        except (OSError, configparser.Error):
+            self.config = configparser.ConfigParser()  # missing or unreadable file, the defaults are used
+        self.saved_settings = self.settings_text()
+        self.sound_on = self.config.getboolean('sound', 'sound_on', fallback=True)
+        self.color_mode = self.config.get('color', 'color_mode', fallback='light')
+        self.detector = self.config.get('analysis', 'detector', fallback='hps')
+        self.geometry(self.config.get('window', 'geometry', fallback='550x400'))
+        if self.config.getboolean('window', 'zoomed', fallback=False) == True:
             self.state("zoomed")
 
         # Window options
@@ -87,19 +222,19 @@ class main_window(tk.Tk):
         scaling_factor = 3
 
         self.i_empty_l = open_image("Assets/Indicators/light/indicator_empty.png", scaling_factor, 'resize',
-                                    Image.NEAREST)
+                                    'nearest')
         self.i_empty_d = open_image("Assets/Indicators/dark/indicator_empty.png", scaling_factor, 'resize',
-                                    Image.NEAREST)
+                                    'nearest')
 
         self.indicator_img_l = []
         self.indicator_img_d = []
         for i in range(4):
             self.indicator_img_l.append(
                 open_image("Assets/Indicators/light/indicator_{}.png".format(i), scaling_factor, 'resize',
-                           Image.NEAREST))
+                           'nearest'))
             self.indicator_img_d.append(
                 open_image("Assets/Indicators/dark/indicator_{}.png".format(i), scaling_factor, 'resize',
-                           Image.NEAREST))
+                           'nearest'))
 
         if self.color_mode == 'light':
             self.indicator_img = self.indicator_img_l
@@ -146,10 +281,10 @@ class main_window(tk.Tk):
             self.fg = self.light_color
 
         # Sound control button
-        self.i_sound_on_l = open_image("Assets/buttons/sound_light.png", scaling_factor, 'resize', Image.NEAREST)
-        self.i_sound_off_l = open_image("Assets/buttons/mute_light.png", scaling_factor, 'resize', Image.NEAREST)
-        self.i_sound_on_d = open_image("Assets/buttons/sound_dark.png", scaling_factor, 'resize', Image.NEAREST)
-        self.i_sound_off_d = open_image("Assets/buttons/mute_dark.png", scaling_factor, 'resize', Image.NEAREST)
+        self.i_sound_on_l = open_image("Assets/buttons/sound_light.png", scaling_factor, 'resize', 'nearest')
+        self.i_sound_off_l = open_image("Assets/buttons/mute_light.png", scaling_factor, 'resize', 'nearest')
+        self.i_sound_on_d = open_image("Assets/buttons/sound_dark.png", scaling_factor, 'resize', 'nearest')
+        self.i_sound_off_d = open_image("Assets/buttons/mute_dark.png", scaling_factor, 'resize', 'nearest')
 
         if self.color_mode == 'light':
             self.i_sound_on = self.i_sound_on_l
@@ -166,7 +301,7 @@ class main_window(tk.Tk):
 
         # A4 frequency tuning
         self.A4_freq = tk.StringVar()
-        self.A4_freq.set(self.config['a4_tuning']['frequency'])
+        self.A4_freq.set(self.config.get('a4_tuning', 'frequency', fallback='440'))
 
         self.A4_freq_frame = tk.Frame()
         for i in range(4):
@@ -191,6 +326,7 @@ class main_window(tk.Tk):
         self.A4_freq_frame.grid(row=2, column=4)
 
         # Variables for gui updates
+        self.renderer = widget_renderer()
         self.no_update_count = 0
         self.updated_indicator = None
         self.last_direction = None
@@ -202,6 +338,7 @@ class main_window(tk.Tk):
         self.protocol("WM_DELETE_WINDOW", self.on_exit)
         self.bind("<Configure>", self.on_config)
         self.update_color()
+        self.renderer.flush()
 
     def on_config(self, event):
         # Used to restore window if it's closed while minimized
@@ -213,27 +350,39 @@ class main_window(tk.Tk):
 
     def sound_button_pressed(self):
         if self.sound_on:
-            self.sound_mute_b.configure(image=self.i_sound_off)
+            self.renderer.set(self.sound_mute_b, image=self.i_sound_off)
         else:
-            self.sound_mute_b.configure(image=self.i_sound_on)
+            self.renderer.set(self.sound_mute_b, image=self.i_sound_on)
         self.sound_on = not self.sound_on
+        self.renderer.flush()
+
+    def settings_text(self):
+        text = io.StringIO()
+        self.config.write(text)
+        return text.getvalue()
+
+    def set_setting(self, section, option, value):
+        if not self.config.has_section(section):
+            self.config[section] = {}
+        self.config[section][option] = value
 
     def on_exit(self):
-        # Write settings to file
-        self.config['sound']['sound_on'] = str(self.sound_on)
-        self.config['color']['color_mode'] = self.color_mode
-        self.config['a4_tuning']['frequency'] = self.A4_freq.get()
-        self.config['window']['geometry'] = self.geometry()
+        # Write settings to file if any changed
+        self.set_setting('sound', 'sound_on', str(self.sound_on))
+        self.set_setting('color', 'color_mode', self.color_mode)
+        self.set_setting('a4_tuning', 'frequency', self.A4_freq.get())
+        self.set_setting('window', 'geometry', self.geometry())
         if self.state() == 'zoomed':
-            self.config['window']['zoomed'] = 'True'
+            self.set_setting('window', 'zoomed', 'True')
         elif self.state() == 'normal':
-            self.config['window']['zoomed'] = 'False'
+            self.set_setting('window', 'zoomed', 'False')
         elif self.state() == 'iconic':
-            self.config['window']['zoomed'] = 'False'
+            self.set_setting('window', 'zoomed', 'False')
             if self.last_state == 'zoomed':
-                self.config['window']['geometry'] = '550x400'
-        with open('settings.ini', 'w') as configfile:
-            self.config.write(configfile)
+                self.set_setting('window', 'geometry', '550x400')
+        if self.settings_text() != self.saved_settings:
+            with open(settings_file, 'w') as configfile:
+                self.config.write(configfile)
         # Close window
         self.destroy()
 
@@ -241,88 +390,123 @@ class main_window(tk.Tk):
         if self.last_direction == None: return
 
         if self.last_direction == '✓':
-            self.Note_label.configure(fg=self.fg)
+            self.renderer.set(self.Note_label, fg=self.fg)
         else:
-            self.updated_indicator.configure(image=self.i_empty)
+            self.renderer.set(self.updated_indicator, image=self.i_empty)
 
         self.last_direction = None
         self.updated_indicator = None
 
+    def update_channel_rows(self, results, hold=True):
+        # one row per input channel (or voice of polyphonic analysis) below the controls (created on first use)
+        if not hasattr(self, 'channel_labels'):
+            self.channel_frame = tk.Frame(self)
+            self.channel_frame.grid(row=3, column=0, columnspan=9, sticky='we')
+            self.channel_frame.columnconfigure(0, weight=1)
+            self.channel_labels = []
+            for channel in range(len(results)):
+                label = tk.Label(self.channel_frame, text='{}: *'.format(channel + 1), font=('LCD Solid', 14),
+                                 anchor='w')
+                label.grid(row=channel, column=0, sticky='we')
+                self.channel_labels.append(label)
+
+        self.renderer.set(self.channel_frame, bg=self.bg)
+        for channel, (label, result) in enumerate(zip(self.channel_labels, results)):
+            tune_direction, _, tune_amount = tune_state(result)
+            if tune_direction is None:
+                # a silent channel keeps showing its last note, unused voices are cleared
+                if hold:
+                    self.renderer.set(label, bg=self.bg)
+                else:
+                    self.renderer.set(label, text='{}: *'.format(channel + 1), bg=self.bg, fg=self.fg)
+                continue
+            self.renderer.set(label, text='{}: {} {} {} Hz ({}{})'.format(
+                channel + 1, result.note, result.octave, round(result.frequency, 1), tune_direction,
+                round(tune_amount, 2)), bg=self.bg, fg='#00ff1b' if tune_direction == '✓' else self.fg)
+
+    def show_debug_overlay(self, text):
+        # stage timing summary below the controls (created on first use)
+        if not hasattr(self, 'debug_label'):
+            self.debug_label = tk.Label(self, font=('Courier', 8), justify='left', anchor='w')
+            self.debug_label.grid(row=4, column=0, columnspan=9, sticky='we')
+        self.renderer.set(self.debug_label, text=text, bg=self.bg, fg=self.fg)
+
     def clear_labels(self):
         # remove text from all labels
         self.clear_indicator()
-        self.Note_label.configure(text='*', fg=self.fg)
-        self.octave_label.configure(text='*', fg=self.fg)
-        self.freq_label.configure(text='* Hz ()', fg=self.fg)
+        self.renderer.set(self.Note_label, text='*', fg=self.fg)
+        self.renderer.set(self.octave_label, text='*', fg=self.fg)
+        self.renderer.set(self.freq_label, text='* Hz ()', fg=self.fg)
 
     def update_labels(self, Note, octave, frequency, tune_direction, tune_level, tune_amount):
         # update all labels
         self.clear_indicator()
-        self.Note_label.configure(text=Note)
-        self.octave_label.configure(text=octave)
-        self.freq_label.configure(
-            text=(round(frequency, 1), "Hz", "({}{})".format(tune_direction, round(tune_amount, 2))))
+        self.renderer.set(self.Note_label, text=Note)
+        self.renderer.set(self.octave_label, text=octave)
+        self.renderer.set(self.freq_label,
+                          text=(round(frequency, 1), "Hz", "({}{})".format(tune_direction, round(tune_amount, 2))))
 
         # Update indicators
         if tune_direction == '✓':
-            self.Note_label.configure(fg="#00ff1b")
-            self.octave_label.configure(fg="#00ff1b")
+            self.renderer.set(self.Note_label, fg="#00ff1b")
+            self.renderer.set(self.octave_label, fg="#00ff1b")
             if Note != self.previous_note:
                 if self.sound_on:
                     winsound.PlaySound('Assets/tune_sound.wav', winsound.SND_FILENAME + winsound.SND_ASYNC)
                 self.previous_note = Note
         elif tune_direction == '↓':
-            self.Note_label.configure(fg=self.fg)
-            self.octave_label.configure(fg=self.fg)
-            self.freq_label.configure(fg=self.fg)
+            self.renderer.set(self.Note_label, fg=self.fg)
+            self.renderer.set(self.octave_label, fg=self.fg)
+            self.renderer.set(self.freq_label, fg=self.fg)
 
-            self.right_indicators[tune_level].configure(image=self.indicator_img[tune_level])
+            self.renderer.set(self.right_indicators[tune_level], image=self.indicator_img[tune_level])
             self.updated_indicator = self.right_indicators[tune_level]
             self.previous_note = None
         elif tune_direction == '↑':
-            self.Note_label.configure(fg=self.fg)
-            self.octave_label.configure(fg=self.fg)
-            self.freq_label.configure(fg=self.fg)
+            self.renderer.set(self.Note_label, fg=self.fg)
+            self.renderer.set(self.octave_label, fg=self.fg)
+            self.renderer.set(self.freq_label, fg=self.fg)
 
-            self.left_indicators[abs(tune_level - 3)].configure(image=self.indicator_img[tune_level])
+            self.renderer.set(self.left_indicators[abs(tune_level - 3)], image=self.indicator_img[tune_level])
             self.updated_indicator = self.left_indicators[abs(tune_level - 3)]
             self.previous_note = None
         self.last_direction = tune_direction
         self.last_tune_level = tune_level
 
     def update_color(self):
-        self.color_mode_button.configure(image=self.color_mode_icon, bg=self.bg, activebackground=self.bg)
+        self.renderer.set(self.color_mode_button, image=self.color_mode_icon, bg=self.bg, activebackground=self.bg)
 
-        self['bg'] = self.bg
+        self.renderer.set(self, bg=self.bg)
         if self.last_direction == '✓':
-            self.Note_label.configure(background=self.bg)
-            self.octave_label.configure(background=self.bg)
+            self.renderer.set(self.Note_label, bg=self.bg)
+            self.renderer.set(self.octave_label, bg=self.bg)
         else:
-            self.Note_label.configure(background=self.bg, foreground=self.fg)
-            self.octave_label.configure(background=self.bg, foreground=self.fg)
-        self.freq_label.configure(background=self.bg, foreground=self.fg)
-        self.Note_frame.configure(background=self.bg)
+            self.renderer.set(self.Note_label, bg=self.bg, fg=self.fg)
+            self.renderer.set(self.octave_label, bg=self.bg, fg=self.fg)
+        self.renderer.set(self.freq_label, bg=self.bg, fg=self.fg)
+        self.renderer.set(self.Note_frame, bg=self.bg)
 
-        self.sound_mute_b.configure(bg=self.bg, activebackground=self.bg)
+        self.renderer.set(self.sound_mute_b, bg=self.bg, activebackground=self.bg)
         if self.sound_on:
-            self.sound_mute_b.configure(image=self.i_sound_on)
+            self.renderer.set(self.sound_mute_b, image=self.i_sound_on)
         else:
-            self.sound_mute_b.configure(image=self.i_sound_off)
+            self.renderer.set(self.sound_mute_b, image=self.i_sound_off)
 
         for i in range(4):
-            self.left_indicators[i].configure(image=self.i_empty, bg=self.bg, fg=self.fg)
-            self.right_indicators[i].configure(image=self.i_empty, bg=self.bg, fg=self.fg)
+            self.renderer.set(self.left_indicators[i], image=self.i_empty, bg=self.bg, fg=self.fg)
+            self.renderer.set(self.right_indicators[i], image=self.i_empty, bg=self.bg, fg=self.fg)
 
         if self.last_direction == '↓':
-            self.right_indicators[self.last_tune_level].configure(image=self.indicator_img[self.last_tune_level])
+            self.renderer.set(self.right_indicators[self.last_tune_level],
+                              image=self.indicator_img[self.last_tune_level])
         elif self.last_direction == '↑':
-            self.left_indicators[abs(self.last_tune_level - 3)].configure(
-                image=self.indicator_img[self.last_tune_level])
+            self.renderer.set(self.left_indicators[abs(self.last_tune_level - 3)],
+                              image=self.indicator_img[self.last_tune_level])
 
-        self.A4_freq_frame['bg'] = self.bg
-        self.A4_label_1.configure(background=self.bg, foreground=self.fg)
-        self.A4_label_2.configure(background=self.bg, foreground=self.fg)
-        self.A4_reset_b.configure(image=self.i_reset, background=self.bg, activebackground=self.bg)
+        self.renderer.set(self.A4_freq_frame, bg=self.bg)
+        self.renderer.set(self.A4_label_1, bg=self.bg, fg=self.fg)
+        self.renderer.set(self.A4_label_2, bg=self.bg, fg=self.fg)
+        self.renderer.set(self.A4_reset_b, image=self.i_reset, bg=self.bg, activebackground=self.bg)
 
     def switch_color_mode(self):
         if self.color_mode == 'light':
@@ -355,56 +539,147 @@ class main_window(tk.Tk):
             self.i_reset = self.i_reset_l
 
         self.update_color()
+        self.renderer.flush()
+
+
+def tune_state(result):
+    """
+    Returns how far and in which direction the detected frequency of a result is from its closest note
+
+    :param result: an audio_pipeline.analysis_result
+    :return: a tuple with the tune direction ('↑', '↓', '✓' or None if no note was detected), the tune level (0 to 3,
+    None when in tune) and the frequency offset from the closest note in Hz
+    """
+    loudest_frequency = result.frequency
+    closest_frequency, closest_note = result.closest_frequency, result.note
+    if closest_frequency is None or closest_note is None:
+        return None, None, None
+
+    # Find tune direction
+    tune_amount = abs(loudest_frequency - closest_frequency)
+    if tune_amount > 0.5:
+        if loudest_frequency < closest_frequency:
+            tune_direction = '↑'
+        else:
+            tune_direction = '↓'
+    else:
+        tune_direction = '✓'
 
+    # Find tune level
+    tune_level = None
+    if tune_direction != '✓':
+        distance = result.neighbour_distance / 2
 
-def main_gui():
-    interval = 0.5
+        if tune_amount > 0.8 * distance:
+            tune_level = 3
+        elif tune_amount > 0.6 * distance:
+            tune_level = 2
+        elif tune_amount > 0.3 * distance:
+            tune_level = 1
+        elif tune_amount > 0.5:
+            tune_level = 0
+
+    return tune_direction, tune_level, tune_amount
+
+
+def main_gui(window=0.5, hop=0.05, analyzer_options=None, stats_interval=None, source=None, fps=30, gate_threshold=None,
+             calibration=None, decimation=1, spectrogram=False, record=None, voices=1):
     app = main_window()
-    audio_generator = read_real_time_audio(interval)
+    if analyzer_options is None or 'detector' not in analyzer_options:
+        # no detector given on the command line, use the one from settings (polyphonic analysis needs hps)
+        if voices > 1:
+            analyzer_options = dict(analyzer_options or {}, detector='hps')
+        elif app.detector in ('hps', 'tracking', 'multires'):
+            analyzer_options = dict(analyzer_options or {}, detector=app.detector)
+        else:
+            analyzer_options = {'detector': app.detector}
+    stats = pipeline_stats() if stats_interval else no_stats
+    pipeline = audio_pipeline(window, hop, int(app.A4_freq.get()), analyzer_options, stats=stats, source=source,
+                              gate_threshold=gate_threshold or None, decimation=decimation, voices=voices)
+
+    # the energy gate threshold of an input device is measured on first use and kept in settings.ini
+    gate_key = gate_settings_key(pipeline.capture, decimation)
+    if gate_threshold is None and calibration is None and gate_key is not None:
+        if app.config.has_option('gate', gate_key):
+            pipeline.gate.threshold = parse_gate_threshold(app.config['gate'][gate_key])
+        else:
+            calibration = 2.0
+    if calibration:
+        def store_threshold(threshold):
+            # settings are written on exit
+            if gate_key is not None:
+                app.set_setting('gate', gate_key, format_gate_threshold(threshold))
+
+        def calibrated(threshold):
+            # called on the analysis thread, the settings belong to the Tk thread
+            app.after(0, store_threshold, threshold)
+
+        pipeline.calibrate(calibration, callback=calibrated)
+
+    if record is not None:
+        pipeline.record(record)
+
+    view = None
+    if spectrogram:
+        pipeline.enable_spectrogram()
+        view = spectrogram_view(app, pipeline.spectrogram_frequencies,
+                                harmonics=(analyzer_options or {}).get('harmonics', 4))
+        view.label.grid(row=5, column=0, columnspan=9)
+    clear_after = max(1, int(round(1.5 / hop)))  # clear labels after ~1.5 seconds without a note
+    poll_interval = max(10, int(1000 * hop / 2))
+    frame_interval = max(1, int(1000 / fps))  # display updates are capped independently of the analysis rate
 
     def update_labels():
-        f_0 = int(app.A4_freq.get())
-        sample_rate, signal = next(audio_generator)
-        _, _, _, loudest_frequency, loudest_frequency_amplitude = audio_fft(signal, sample_rate)
-        closest_frequency, closest_note, octave = frequency_to_note(loudest_frequency, loudest_frequency_amplitude, f_0)
-        tune_direction = None
-        tune_level = None
-
-        if closest_frequency is not None and closest_note is not None:
-            # Find tune direction
-            if abs(loudest_frequency - closest_frequency) > 0.5:
-                if loudest_frequency < closest_frequency:
-                    tune_direction = '↑'
-                else:
-                    tune_direction = '↓'
-            else:
-                tune_direction = '✓'
-
-            # Find tune level
-            if tune_direction != '✓':
-                neighbor = neighbour_note_frequency(closest_frequency, loudest_frequency, f_0)
-                distance = abs(closest_frequency - neighbor) / 2
-
-                if abs(loudest_frequency - closest_frequency) > 0.8 * distance:
-                    tune_level = 3
-                elif abs(loudest_frequency - closest_frequency) > 0.6 * distance:
-                    tune_level = 2
-                elif abs(loudest_frequency - closest_frequency) > 0.3 * distance:
-                    tune_level = 1
-                elif abs(loudest_frequency - closest_frequency) > 0.5:
-                    tune_level = 0
-
-            app.update_labels(closest_note, octave, loudest_frequency, tune_direction, tune_level,
-                              abs(loudest_frequency - closest_frequency))
+        # capture and analysis run on background threads, only pick up the latest result
+        pipeline.f_0 = int(app.A4_freq.get())
+        result = pipeline.latest()
+        if pipeline.calibrating():
+            app.renderer.set(app.freq_label, text='Calibrating...')
+        if result is None:
+            app.after(poll_interval, update_labels)
+            return
+
+        start = stats.time()
+        if isinstance(result, multi_result):
+            # multi-channel source or polyphonic analysis, one row per channel (voice) and the loudest one with a note
+            # on the main display
+            app.update_channel_rows(result, hold=voices == 1)
+            voiced = [channel_result for channel_result in result if channel_result.note is not None]
+            result = max(voiced, key=lambda channel_result: channel_result.amplitude) if voiced else result[0]
+
+        tune_direction, tune_level, tune_amount = tune_state(result)
+        if tune_direction is not None:
+            app.update_labels(result.note, result.octave, result.frequency, tune_direction, tune_level, tune_amount)
             app.no_update_count = 0
         else:
             app.no_update_count += 1
-            if app.no_update_count == 3:
+            if app.no_update_count == clear_after:
                 app.clear_labels()
                 app.no_update_count = 0
-
-        app.after(int(1000 * interval), update_labels)
-
+        stats.record('gui', start)
+
+        app.after(poll_interval, update_labels)
+
+    def render():
+        start = stats.time()
+        app.renderer.flush()
+        if view is not None:
+            # columns analyzed since the last frame, the analysis thread is never waited for
+            while pipeline.spectrogram:
+                view.add_column(*pipeline.spectrogram.popleft())
+            view.draw()
+        stats.record('render', start)
+        stats.set('configures', app.renderer.configure_calls)
+        app.after(frame_interval, render)
+
+    def update_debug_overlay():
+        app.show_debug_overlay(stats.format_summary())
+        app.after(int(1000 * stats_interval), update_debug_overlay)
+
+    pipeline.start()
     update_labels()
+    render()
+    if stats.enabled:
+        update_debug_overlay()
     app.mainloop()
-    audio_generator.close()
+    pipeline.stop()
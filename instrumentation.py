@@ -0,0 +1,156 @@
+import math
+import time
+
+
+class rolling_histogram:
+    """
+    Histogram of the most recent durations with logarithmic bins
+
+    Recording is O(1) (the oldest value leaves the histogram when a new one is recorded), percentiles are read from
+    the bin counts with a resolution of one bin (about 12 % with 20 bins per decade).
+    """
+
+    def __init__(self, size=1000, min_value=1e-6, max_value=10.0, bins_per_decade=20):
+        """
+        :param size: the number of recent values kept
+        :param min_value: the lower edge of the first bin (smaller values are counted in it)
+        :param max_value: the upper edge of the last bin (larger values are counted in it)
+        :param bins_per_decade: the number of bins per factor of 10
+        """
+        self.min_value = min_value
+        self.bins_per_decade = bins_per_decade
+        self.counts = [0] * (int(math.ceil(math.log10(max_value / min_value) * bins_per_decade)) + 1)
+
+        self.recent = [None] * size  # bin of each recent value
+        self.position = 0
+        self.total = 0
+
+    def record(self, value):
+        index = 0
+        if value > self.min_value:
+            index = min(int(math.log10(value / self.min_value) * self.bins_per_decade), len(self.counts) - 1)
+
+        old = self.recent[self.position]
+        if old is None:
+            self.total += 1
+        else:
+            self.counts[old] -= 1
+        self.recent[self.position] = index
+        self.counts[index] += 1
+        self.position = (self.position + 1) % len(self.recent)
+
+    def percentile(self, q):
+        """
+        :param q: the percentile (0 to 100)
+        :return: the approximate q-th percentile of the recent values (None if nothing was recorded)
+        """
+        if self.total == 0:
+            return None
+
+        rank = q / 100 * self.total
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if count and cumulative >= rank:
+                return self.min_value * 10 ** ((index + 0.5) / self.bins_per_decade)
+
+
+class pipeline_stats:
+    """
+    Opt-in per-stage timing and counters of the analysis pipeline
+
+    Stages call time() before and record(stage, start) after their work; record returns the current time so
+    consecutive stages can be chained. Use no_stats (which does nothing) when instrumentation is off.
+    """
+
+    enabled = True
+
+    def __init__(self, size=1000):
+        """
+        :param size: the number of recent durations kept per stage
+        """
+        self.size = size
+        self.stages = {}  # stage name to rolling_histogram, in pipeline order
+        self.counters = {}
+
+        self.last_summary_time = time.perf_counter()
+        self.last_summary_frames = 0
+
+    def time(self):
+        return time.perf_counter()
+
+    def record(self, stage, start):
+        """
+        Records the duration of a stage
+
+        :param stage: the stage name
+        :param start: the value of time() when the stage started
+        :return: the current time
+        """
+        now = time.perf_counter()
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = rolling_histogram(self.size)
+        histogram.record(now - start)
+        return now
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def set(self, counter, value):
+        self.counters[counter] = value
+
+    def summary(self):
+        """
+        Returns the stage percentiles, the analysis rate since the last summary and the counters
+
+        :return: a tuple with a dictionary of stage name to (p50, p95, p99) in seconds, the analyzed frames per second
+        and a copy of the counters
+        """
+        now = time.perf_counter()
+        frames = self.counters.get('frames', 0)
+        rate = (frames - self.last_summary_frames) / max(now - self.last_summary_time, 1e-9)
+        self.last_summary_time = now
+        self.last_summary_frames = frames
+
+        stages = {stage: tuple(histogram.percentile(q) for q in (50, 95, 99))
+                  for stage, histogram in list(self.stages.items())}
+        return stages, rate, dict(self.counters)
+
+    def format_summary(self):
+        """
+        :return: the summary as text with one line per stage
+        """
+        stages, rate, counters = self.summary()
+
+        lines = ['{:<10} p50 {:7.3f} ms  p95 {:7.3f} ms  p99 {:7.3f} ms'.format(stage, *(1000 * p for p in percentiles))
+                 for stage, percentiles in stages.items()]
+        lines.append('rate {:.1f}/s  '.format(rate) + '  '.join(
+            '{} {}'.format(counter, value) for counter, value in counters.items()))
+        return '\n'.join(lines)
+
+
+class null_stats(pipeline_stats):
+    """
+    Instrumentation that records nothing (the default)
+    """
+
+    enabled = False
+
+    def __init__(self):
+        super().__init__(size=1)
+
+    def time(self):
+        return 0
+
+    def record(self, stage, start):
+        return 0
+
+    def count(self, counter, n=1):
+        pass
+
+    def set(self, counter, value):
+        pass
+
+
+no_stats = null_stats()
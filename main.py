@@ -1,34 +1,220 @@
 import argparse
-import gui
-from audio_read import read_real_time_audio
-from audio_utils import audio_fft, frequency_to_note
-
-def main_headless():
-    audio_generator = read_real_time_audio()
-
-    for sample_rate, signal in audio_generator:
-        _, _, _, loudest_frequency, loudest_frequency_amplitude = audio_fft(signal, sample_rate)
-        closest_frequency, closest_note, octave = frequency_to_note(loudest_frequency, loudest_frequency_amplitude)
-        tune_direction = None
-
-        if closest_frequency is not None and closest_note is not None:
-            if abs(loudest_frequency - closest_frequency) > 0.5:
-                if loudest_frequency < closest_frequency:
-                    tune_direction = '↑'
-                else:
-                    tune_direction = '↓'
+import time
+import numpy as np
+from audio_pipeline import audio_pipeline, multi_result, gate_settings_key, read_gate_threshold, write_gate_threshold
+from audio_read import file_pitch_track, file_audio_source, synthetic_audio_source, real_time_audio_capture, \
+    multi_device_capture
+from analysis_cache import analysis_cache
+from batch_analysis import batch_pitch_track, file_duration, save_batch, track_summary
+from instrumentation import pipeline_stats, no_stats
+from pitch_detection import pitch_detectors
+
+def main_headless(window=1, hop=0.05, analyzer_options=None, stats_interval=None, source=None, gate_threshold=None,
+                  calibration=None, decimation=1, record=None, voices=1):
+    stats = pipeline_stats() if stats_interval else no_stats
+    pipeline = audio_pipeline(window, hop, analyzer_options=analyzer_options, stats=stats, source=source,
+                              gate_threshold=gate_threshold or None, decimation=decimation, voices=voices)
+
+    # the energy gate threshold of an input device is measured once and kept in settings.ini
+    gate_key = gate_settings_key(pipeline.capture, decimation)
+    if gate_threshold is None and calibration is None and gate_key is not None:
+        pipeline.gate.threshold = read_gate_threshold(gate_key)
+        if pipeline.gate.threshold is None:
+            calibration = 2.0
+    if calibration:
+        def calibrated(threshold):
+            print('Gate threshold: ' + str(threshold))
+            if gate_key is not None:
+                write_gate_threshold(gate_key, threshold)
+
+        print('Measuring noise floor for {} seconds, keep quiet...'.format(calibration))
+        pipeline.calibrate(calibration, callback=calibrated)
+
+    if record is not None:
+        pipeline.record(record)
+    pipeline.start()
+    last_summary = time.perf_counter()
+
+    try:
+        while True:
+            result = pipeline.wait_result(timeout=stats_interval)
+            if result is None and pipeline.finished:
+                if stats.enabled:
+                    print(stats.format_summary())
+                break
+
+            if stats.enabled and time.perf_counter() - last_summary >= stats_interval:
+                print(stats.format_summary())
+                last_summary = time.perf_counter()
+
+            if result is not None:
+                start = stats.time()
+                print_result(result)
+                stats.record('output', start)
+    finally:
+        pipeline.stop()
+
+def print_result(result, channel=None):
+    if isinstance(result, multi_result):
+        # multi-channel source or polyphonic analysis, one line per channel (voice) with a note
+        for channel, channel_result in enumerate(result, 1):
+            print_result(channel_result, channel)
+        return
+
+    loudest_frequency = result.frequency
+    closest_frequency, closest_note, octave = result.closest_frequency, result.note, result.octave
+    tune_direction = None
+
+    if closest_frequency is not None and closest_note is not None:
+        if abs(loudest_frequency - closest_frequency) > 0.5:
+            if loudest_frequency < closest_frequency:
+                tune_direction = '↑'
             else:
-                tune_direction = '✓'
+                tune_direction = '↓'
+        else:
+            tune_direction = '✓'
+
+        print(('[{}] '.format(channel) if channel is not None else '') +
+              str(loudest_frequency) + 'Hz (' + closest_note + ' ' + octave + ') ' + tune_direction)
 
-            print(
-                str(loudest_frequency) + 'Hz (' + closest_note + ' ' + octave + ') ' + tune_direction)
-    
-    audio_generator.close()
+def main_track(file_name, window=1, hop=0.05, f_0=440.0, output=None, analyzer_options=None, cache=None):
+    if cache is not None:
+        track = cache.pitch_track(file_name, window, hop, f_0, analyzer_options=analyzer_options)
+    else:
+        track = file_pitch_track(file_name, window, hop, f_0, analyzer_options=analyzer_options)
+    time, frequency, note, cents, amplitude = track
+
+    if output is not None:
+        np.savez(output, time=time, frequency=frequency, note=note, cents=cents, amplitude=amplitude)
+        return
+
+    for t, f, n, c in zip(time, frequency, note, cents):
+        if n:
+            print('{:.2f}s '.format(t) + str(f) + 'Hz (' + n + ') ' + '{:+.1f} cents'.format(c))
+
+def main_batch(paths, window=1, hop=0.05, f_0=440.0, output='pitch_tracks.npz', workers=None, chunk_duration=300,
+               analyzer_options=None, cache=None):
+    tracks = batch_pitch_track(paths, window, hop, f_0, workers, chunk_duration, analyzer_options, cache=cache)
+    save_batch(tracks, output)
+
+    for file_name, track in tracks.items():
+        summary = track_summary(track, file_duration(file_name))
+        print('{} {:.1f}s {} frames, {:.0%} with a note, main note {}, median offset {:.1f} cents'.format(
+            file_name, summary['duration'], summary['frames'], summary['voiced_ratio'], summary['main_note'] or '-',
+            summary['median_abs_cents']))
+    if cache is not None:
+        print('{} files loaded from the cache, {} analyzed'.format(cache.hits, cache.misses))
+
+def open_cache(args):
+    if args.cache is None:
+        return None
+    return analysis_cache(args.cache, int(args.cache_size * 1024 * 1024))
 
 if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument('-headless', action='store_true', help='Use command line instead of GUI')
+    arg_parser.add_argument('-window', type=float, default=None,
+                            help='Analysis window length in seconds (default: 1 headless, 0.5 GUI)')
+    arg_parser.add_argument('-hop', type=float, default=0.05, help='Time between analysis windows in seconds')
+    arg_parser.add_argument('-stats', type=float, nargs='?', const=2.0, default=None, metavar='SECONDS',
+                            help='Print stage timing summaries every SECONDS (default: 2) in headless mode, show '
+                                 'them in a debug overlay in the GUI')
+    arg_parser.add_argument('-detector', choices=list(pitch_detectors), default=None,
+                            help='Pitch detection method (default: hps, or the GUI setting)')
+    arg_parser.add_argument('-window_function', default='boxcar',
+                            help='Window function applied before the FFT (e.g. boxcar, hann)')
+    arg_parser.add_argument('-interpolation', choices=['quadratic', 'gaussian'], default=None,
+                            help='Refine the detected frequency between FFT bins')
+    arg_parser.add_argument('-zero_padding', type=int, default=1, help='FFT length as a multiple of the window length')
+    arg_parser.add_argument('-harmonics', type=int, default=4,
+                            help='Number of harmonics multiplied in the harmonic product spectrum (including the '
+                                 'fundamental)')
+    arg_parser.add_argument('-band', type=float, nargs=2, default=None, metavar=('LOW', 'HIGH'),
+                            help='Only search fundamentals between LOW and HIGH Hz (e.g. 70 400 for a guitar)')
+    arg_parser.add_argument('-gate', type=float, default=None, metavar='RMS',
+                            help='Skip analysis of windows quieter than this RMS level (default: calibrated per input '
+                                 'device and stored in settings.ini, 0 analyzes every window)')
+    arg_parser.add_argument('-calibrate', type=float, nargs='?', const=2.0, default=None, metavar='SECONDS',
+                            help='Measure the noise floor of the input for SECONDS (default: 2) to set the gate')
+    arg_parser.add_argument('-decimate', type=int, default=1, metavar='FACTOR',
+                            help='Low-pass filter and decimate the input by FACTOR before analysis (e.g. 10)')
+    arg_parser.add_argument('-voices', type=int, default=1, metavar='N',
+                            help='Polyphonic mode, find up to N simultaneous notes (e.g. 6 to tune all strings from '
+                                 'one strum, hps detector only)')
+    arg_parser.add_argument('-fps', type=float, default=30, help='Maximum display updates per second in the GUI')
+    arg_parser.add_argument('-spectrogram', action='store_true',
+                            help='Show a live spectrogram with the harmonics of the detected note in the GUI')
+    source_group = arg_parser.add_mutually_exclusive_group()
+    source_group.add_argument('-replay', metavar='FILE', default=None,
+                              help='Analyze a WAV file as if it was audio input')
+    source_group.add_argument('-tone', metavar='HZ', type=float, nargs='+', default=None,
+                              help='Analyze a synthetic tone instead of audio input (one per channel if several)')
+    source_group.add_argument('-devices', metavar='INDEX', type=int, nargs='+', default=None,
+                              help='Capture several audio input devices (PyAudio device indices) together')
+    arg_parser.add_argument('-channels', type=int, default=1,
+                            help='Number of input channels to capture (per device), each tuned independently')
+    arg_parser.add_argument('-record', metavar='PREFIX', default=None,
+                            help='Record the captured audio and the results to PREFIX.wav and PREFIX.npz')
+    arg_parser.add_argument('-fast', action='store_true',
+                            help='Replay or generate as fast as possible instead of in real time')
+    subparsers = arg_parser.add_subparsers(dest='command')
+
+    track_parser = subparsers.add_parser('track', help='Print or save the pitch track of a WAV file')
+    track_parser.add_argument('file', help='WAV file to analyze')
+    track_parser.add_argument('-a4', type=float, default=440.0, help='Frequency of A4 note in Hz')
+    track_parser.add_argument('-o', dest='output', default=None, help='Save the pitch track arrays to a .npz file')
+
+    batch_parser = subparsers.add_parser('batch', help='Analyze many WAV files in parallel into one .npz file')
+    batch_parser.add_argument('paths', nargs='+', help='WAV files, directories or glob patterns')
+    batch_parser.add_argument('-a4', type=float, default=440.0, help='Frequency of A4 note in Hz')
+    batch_parser.add_argument('-o', dest='output', default='pitch_tracks.npz', help='Output .npz file')
+    batch_parser.add_argument('-workers', type=int, default=None, help='Number of worker processes (default: CPUs)')
+    batch_parser.add_argument('-chunk', type=float, default=300,
+                              help='Split long files into chunks of this many seconds')
+    for offline_parser in (track_parser, batch_parser):
+        offline_parser.add_argument('-cache', metavar='DIR', nargs='?', const='.analysis_cache', default=None,
+                                    help='Reuse the results of files analyzed before with the same parameters, stored '
+                                         'in DIR (default: .analysis_cache)')
+        offline_parser.add_argument('-cache_size', metavar='MB', type=float, default=512,
+                                    help='Maximum size of the cache, least recently used results are removed first')
     args = arg_parser.parse_args()
 
-    if args.headless: main_headless()
-    else : gui.main_gui()
\ No newline at end of file
+    analyzer_options = {}
+    if args.detector is not None:
+        analyzer_options['detector'] = args.detector
+    if args.detector in (None, 'hps', 'tracking', 'multires'):
+        analyzer_options.update(window=args.window_function, interpolation=args.interpolation,
+                                zero_padding=args.zero_padding, harmonics=args.harmonics)
+        if args.band is not None:
+            analyzer_options.update(min_frequency=args.band[0], max_frequency=args.band[1])
+
+    if args.command == 'track':
+        main_track(args.file, args.window or 1, args.hop, args.a4, args.output, analyzer_options,
+                   open_cache(args))
+    elif args.command == 'batch':
+        main_batch(args.paths, args.window or 1, args.hop, args.a4, args.output, args.workers, args.chunk,
+                   analyzer_options, open_cache(args))
+    else:
+        source = None
+        if args.replay is not None:
+            source = file_audio_source(args.replay, args.hop, realtime=not args.fast,
+                                       channel=0 if args.channels == 1 else None)
+            if source.channels != args.channels and args.channels > 1:
+                arg_parser.error('-channels {} does not match {} ({} channels).'.format(args.channels, args.replay,
+                                                                                         source.channels))
+        elif args.tone is not None:
+            source = synthetic_audio_source(args.tone[0] if len(args.tone) == 1 else args.tone, args.hop,
+                                            realtime=not args.fast)
+        elif args.devices is not None:
+            source = multi_device_capture(args.devices, int(44100 * args.hop), channels=args.channels)
+        elif args.channels > 1:
+            source = real_time_audio_capture(int(44100 * args.hop), channels=args.channels)
+
+        if args.headless:
+            main_headless(args.window or 1, args.hop, analyzer_options, args.stats, source, args.gate,
+                          args.calibrate, args.decimate, args.record, args.voices)
+        else:
+            import gui  # Tk, PIL and fonts are not needed in headless mode
+
+            gui.main_gui(args.window or 0.5, args.hop, analyzer_options, args.stats, source, args.fps,
+                         args.gate, args.calibrate, args.decimate, args.spectrogram, args.record, args.voices)
\ No newline at end of file
@@ -0,0 +1,598 @@
+import numpy as np
+from scipy.fft import rfft, irfft, next_fast_len
+from functools import lru_cache
+
+from audio_utils import spectrum_analyzer, interpolate_peaks, frame_signal, frequency_to_note_details, max_frequency, \
+    min_frequency
+
+
+class pitch_detector:
+    """
+    Base class of the time-domain pitch detectors
+
+    Every detector (including audio_utils.spectrum_analyzer, the FFT/HPS detector) is built for a fixed sample rate and
+    frame length and has the same interface: analyze for a single frame, analyze_frames for a batch of frames and an
+    amplitude_threshold to pass as min_amplitude to frequency_to_note. Unvoiced frames report a frequency of 0.
+
+    A decaying string often loses its fundamental (and other partials) before the rest, so a lag of a half, a third or
+    a quarter of the period becomes as periodic as the period and the frame alone reads an octave or more high (e.g.
+    the 3rd harmonic of A2). A clean note is as periodic at every multiple of its period, so a frame alone cannot tell
+    them apart: consecutive frames of one stream (analyze and analyze_sequence) keep a settled note (the same note as
+    its previous frame, not louder, so the attack of a note never sets it) while the frame reads one of its harmonics
+    2 to 4, the matching multiple of the period stays within subharmonic_tolerance and the amplitude does not rise by
+    onset_ratio (a new note resets it). The note is kept through up to max_gap unvoiced frames. analyze_frames treats
+    every frame on its own.
+    """
+
+    amplitude_threshold = 0.003  # frame RMS
+    subharmonics = (2, 3, 4)  # multiples of the detected period checked against the held note
+    subharmonic_tolerance = 0.1  # difference of the normalized periodicity measure between a period and its multiple
+    onset_ratio = 1.25  # amplitude rise between consecutive frames that starts a new note
+    max_gap = 3  # unvoiced frames a held note survives (e.g. a dropout of a decaying note)
+
+    def __init__(self, sample_rate, samples, min_frequency=40, max_frequency=max_frequency):
+        """
+        :param sample_rate: the sample rate of the audio signal
+        :param samples: the number of samples in each frame
+        :param min_frequency: the lowest detectable frequency (limited by the frame length)
+        :param max_frequency: the highest detectable frequency
+        """
+        self.sample_rate = sample_rate
+        self.samples = samples
+        self.min_lag = max(2, int(sample_rate / max_frequency))
+        self.max_period = int(np.ceil(sample_rate / min_frequency))
+        self.held = None  # (frequency, amplitude, settled, unvoiced frames since) of the last voiced frame
+
+    def reset(self):
+        """
+        Forgets the previous frame (call before analyzing another stream)
+        """
+        self.held = None
+
+    def analyze(self, signal):
+        """
+        Analyzes the next frame of a stream and finds its fundamental frequency
+
+        :param signal: the input audio signal in numpy array format (truncated or zero padded to the frame length)
+        :return: a tuple with the fundamental frequency (0 if unvoiced) and the frame RMS amplitude
+        """
+        frame = np.zeros((1, self.samples), dtype=np.float64)
+        n = min(len(signal), self.samples)
+        frame[0, :n] = signal[:n]
+
+        frequency, amplitude, periodic = self.detect(frame)
+        return self.hold_note(frequency[0], amplitude[0], periodic[0]), amplitude[0]
+
+    def analyze_frames(self, frames):
+        """
+        Analyzes a batch of independent frames
+
+        :param frames: a 2-D numpy array (or strided view) with one frame of length samples per row
+        :return: a tuple with numpy arrays of the fundamental frequency (0 if unvoiced) and RMS amplitude of each frame
+        """
+        frequency, amplitude, _ = self.detect(frames)
+        return frequency, amplitude
+
+    def analyze_sequence(self, frames):
+        """
+        Analyzes a batch of consecutive frames of the stream (e.g. a pitch track), see analyze_frames
+        """
+        frequency, amplitude, periodic = self.detect(frames)
+        for row in range(len(frequency)):
+            frequency[row] = self.hold_note(frequency[row], amplitude[row], periodic[row])
+        return frequency, amplitude
+
+    def detect(self, frames):
+        """
+        :param frames: a 2-D numpy array (or strided view) with one frame of length samples per row
+        :return: a tuple with numpy arrays of the fundamental frequency (0 if unvoiced), the RMS amplitude and a boolean
+        array with a column per subharmonics multiple, True where the frame is as periodic at that multiple of the
+        period
+        """
+        raise NotImplementedError
+
+    def subharmonic_periods(self, refined, lags):
+        """
+        :param refined: the refined period of each frame in samples
+        :param lags: the number of lags of the periodicity measure
+        :return: the lags around each subharmonics multiple of the periods (shape (frames, multiples, 3)) and True where
+        they are all below lags
+        """
+        multiples = np.round(np.multiply.outer(refined, self.subharmonics)).astype(int)
+        around = multiples[..., np.newaxis] + np.arange(-1, 2)
+        return np.clip(around, 0, lags - 1), multiples + 1 < lags
+
+    def hold_note(self, frequency, amplitude, periodic):
+        """
+        :param periodic: the row of detect for the frame
+        :return: the frequency of the held note if the frame reads one of its harmonics, otherwise the frequency
+        """
+        held = self.held
+        if frequency <= 0:
+            self.held = held[:3] + (held[3] + 1,) if held is not None and held[3] < self.max_gap else None
+            return frequency
+
+        if held is not None and held[2] and amplitude <= self.onset_ratio * held[1]:
+            for multiple, is_periodic in zip(self.subharmonics, periodic):
+                if is_periodic and abs(1200 * np.log2(frequency / (multiple * held[0]))) < 50:
+                    frequency /= multiple
+                    break
+        # a note settles once it stops rising and stays settled until it rises like a new note
+        settled = held is not None and abs(1200 * np.log2(frequency / held[0])) < 50 and \
+            amplitude <= (self.onset_ratio if held[2] else 1) * held[1]
+        self.held = (frequency, amplitude, settled, 0)
+        return frequency
+
+    @staticmethod
+    def energy(frames):
+        """
+        :return: the cumulative sum of squares of each frame, starting with 0 (shape (frames, samples + 1))
+        """
+        energy = np.zeros((len(frames), frames.shape[1] + 1))
+        np.cumsum(np.square(frames, dtype=np.float64), axis=1, out=energy[:, 1:])
+        return energy
+
+
+class yin_detector(pitch_detector):
+    """
+    YIN pitch detector (de Cheveigné and Kawahara, 2002) with FFT-accelerated difference function
+
+    Needs about two periods of the fundamental per frame, so low notes are found from much shorter windows than the
+    FFT/HPS detector.
+    """
+
+    subharmonic_tolerance = 0.3  # the dips at multiples of the period are noisier than the normalized peaks of MPM
+
+    def __init__(self, sample_rate, samples, threshold=0.15, min_frequency=40, max_frequency=max_frequency):
+        """
+        :param threshold: the cumulative mean normalized difference below which a lag is accepted as the period
+        """
+        super().__init__(sample_rate, samples, min_frequency, max_frequency)
+        self.threshold = threshold
+
+        # the first half of the frame is compared against lags up to the second half
+        self.integration = samples // 2
+        self.max_lag = min(samples - self.integration, self.max_period)
+        self.fft_size = next_fast_len(samples + self.integration)
+
+    def detect(self, frames):
+        frames = np.asarray(frames, dtype=np.float64)
+        lags = self.max_lag + 1
+        w = self.integration
+
+        # d(tau) = e(0) + e(tau) - 2 r(tau) with r(tau) = sum x_j x_(j + tau) over the integration window
+        r = irfft(np.conj(rfft(frames[:, :w], self.fft_size)) * rfft(frames, self.fft_size), self.fft_size)[:, :lags]
+        energy = self.energy(frames)
+        window_energy = energy[:, w:w + lags] - energy[:, :lags]
+        difference = window_energy[:, :1] + window_energy - 2 * r
+
+        # cumulative mean normalized difference
+        cmndf = np.ones_like(difference)
+        cumulative = np.cumsum(difference[:, 1:], axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cmndf[:, 1:] = np.where(cumulative > 0, difference[:, 1:] * np.arange(1, lags) / cumulative, 1)
+
+        # first dip below threshold, followed down to its local minimum
+        periods = np.zeros(len(frames), dtype=int)
+        for row, values in enumerate(cmndf):
+            below = np.flatnonzero(values[self.min_lag:] < self.threshold)
+            if len(below) == 0:
+                continue
+            tau = below[0] + self.min_lag
+            while tau + 1 < lags and values[tau + 1] < values[tau]:
+                tau += 1
+            periods[row] = tau
+
+        voiced = periods > 0
+        refined = interpolate_peaks(-cmndf, np.maximum(periods, 1), 'quadratic')
+        frequency = np.where(voiced, self.sample_rate / refined, 0)
+
+        # the deepest dip around each multiple of the period
+        rows = np.arange(len(frames))
+        around, inside = self.subharmonic_periods(refined, lags)
+        periodic = voiced[:, np.newaxis] & inside & (cmndf[rows[:, np.newaxis, np.newaxis], around].min(axis=2) <=
+                                                     cmndf[rows, periods][:, np.newaxis] + self.subharmonic_tolerance)
+
+        return frequency, np.sqrt(energy[:, -1] / self.samples), periodic
+
+
+class mpm_detector(pitch_detector):
+    """
+    McLeod pitch method (McLeod and Wyvill, 2005) on the FFT-accelerated normalized square difference function
+    """
+
+    def __init__(self, sample_rate, samples, cutoff=0.9, clarity_threshold=0.6, min_frequency=40,
+                 max_frequency=max_frequency):
+        """
+        :param cutoff: key maxima above cutoff times the highest one are candidates, the first of them is chosen
+        :param clarity_threshold: the normalized peak height below which a frame is unvoiced
+        """
+        super().__init__(sample_rate, samples, min_frequency, max_frequency)
+        self.cutoff = cutoff
+        self.clarity_threshold = clarity_threshold
+
+        self.max_lag = min(samples - 1, self.max_period)
+        self.fft_size = next_fast_len(2 * samples)
+
+    def detect(self, frames):
+        frames = np.asarray(frames, dtype=np.float64)
+        lags = self.max_lag + 1
+        tau = np.arange(lags)
+
+        # n(tau) = 2 r(tau) / m(tau), r is the autocorrelation and m the energy of the overlapping parts
+        spectrum = rfft(frames, self.fft_size)
+        r = irfft(np.square(np.abs(spectrum)), self.fft_size)[:, :lags]
+        energy = self.energy(frames)
+        m = energy[:, self.samples - tau] + energy[:, -1:] - energy[:, tau]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            nsdf = np.where(m > 0, 2 * r / m, 0)
+
+        periods = np.zeros(len(frames), dtype=int)
+        for row, values in enumerate(nsdf):
+            positive = values > 0
+            rising = np.flatnonzero(~positive[:-1] & positive[1:]) + 1
+            falling = np.flatnonzero(positive[:-1] & ~positive[1:]) + 1
+
+            # key maxima: highest point between each positive-going and the next negative-going zero crossing
+            keys = []
+            for start in rising:
+                index = np.searchsorted(falling, start)
+                end = falling[index] if index < len(falling) else lags
+                start = max(start, self.min_lag)
+                if start < end:
+                    keys.append(start + np.argmax(values[start:end]))
+            if not keys:
+                continue
+
+            keys = np.array(keys)
+            chosen = keys[np.argmax(values[keys] >= self.cutoff * values[keys].max())]
+            if values[chosen] >= self.clarity_threshold:
+                periods[row] = chosen
+
+        voiced = periods > 0
+        refined = interpolate_peaks(nsdf, np.maximum(periods, 1), 'quadratic')
+        frequency = np.where(voiced, self.sample_rate / refined, 0)
+
+        # the highest peak around each multiple of the period
+        rows = np.arange(len(frames))
+        around, inside = self.subharmonic_periods(refined, lags)
+        periodic = voiced[:, np.newaxis] & inside & (nsdf[rows[:, np.newaxis, np.newaxis], around].max(axis=2) >=
+                                                     nsdf[rows, periods][:, np.newaxis] - self.subharmonic_tolerance)
+
+        return frequency, np.sqrt(energy[:, -1] / self.samples), periodic
+
+
+class tracking_detector:
+    """
+    FFT/HPS detector that locks on a note and then only evaluates the spectrum in a narrow band around it
+
+    A full-band FFT/HPS finds the note, the following frames evaluate the DFT at a few points half a bin apart around
+    the tracked frequency and at the same offsets around its harmonics (a bank of Goertzel-like filters: the frame is
+    shifted by the tracked frequency and multiplied with cached DFT rows) and multiply them like the HPS. The peak is
+    refined to cent-level precision for much less work than a zero padded full spectrum of the same resolution.
+
+    Detection falls back to the full band when most harmonics hold less than min_harmonic_energy of the frame energy
+    (e.g. another note is played), the peak leaves the band, or every recheck frames. Only analyze keeps the lock (so
+    every stream needs its own instance, see create_pitch_detector), analyze_frames (independent frames or channels)
+    uses the full-band detector.
+    """
+
+    def __init__(self, sample_rate, samples, points=9, min_harmonic_energy=0.01, recheck=20, **options):
+        """
+        :param sample_rate: the sample rate of the audio signal
+        :param samples: the number of samples in each frame
+        :param points: the number of points evaluated around the tracked frequency (half a bin apart)
+        :param min_harmonic_energy: the fraction of the frame energy more than half of the harmonics must each hold to
+        keep the lock
+        :param recheck: the number of frames between full-band detections while locked
+        :param options: keyword arguments passed to the full-band spectrum_analyzer (window, harmonics, ...)
+        """
+        self.coarse = spectrum_analyzer(sample_rate, samples, **options)
+        self.sample_rate = sample_rate
+        self.samples = samples
+        self.min_harmonic_energy = min_harmonic_energy
+        self.recheck = recheck
+        self.amplitude_threshold = self.coarse.amplitude_threshold
+
+        self.spacing = sample_rate / samples / 2  # half a bin
+        self.offsets = np.arange(points) - points // 2
+        # DFT rows at the point offsets around harmonic h (h times the offsets, so the points of all harmonics align)
+        n = np.arange(samples)
+        self.banks = [np.exp(-2j * np.pi * h * self.spacing / sample_rate * np.outer(self.offsets, n)).astype(
+            np.complex64) for h in range(1, self.coarse.harmonics + 1)]
+        self.phase_steps = -2j * np.pi * n / sample_rate
+
+        window = self.coarse.window
+        self.sinusoid_gain = np.sum(window) ** 2 / (2 * np.sum(np.square(window, dtype=np.float64)))
+        self.frame = np.zeros(samples, dtype=np.float32)
+
+        self.tracked = None  # the tracked frequency while locked
+        self.locked_frames = 0
+
+    def reset(self):
+        """
+        Drops the lock (call before analyzing another stream)
+        """
+        self.tracked = None
+
+    @property
+    def stats(self):
+        return self.coarse.stats
+
+    @stats.setter
+    def stats(self, stats):
+        self.coarse.stats = stats
+
+    def refine(self, frequency):
+        """
+        Evaluates the narrow band around frequency and its harmonics in the frame buffer
+
+        :return: a tuple with the refined frequency, its harmonic product amplitude and True if the lock holds
+        """
+        start = self.stats.time()
+        carrier = np.exp(frequency * self.phase_steps).astype(np.complex64)
+        shifted = self.frame * carrier
+
+        magnitudes = []
+        for h, bank in enumerate(self.banks, 1):
+            if h * (frequency + self.offsets[-1] * self.spacing) >= self.sample_rate / 2:
+                break
+            if h > 1:
+                shifted *= carrier  # shift by one more times the frequency
+            magnitudes.append(np.abs(bank @ shifted))
+        magnitudes = np.array(magnitudes, dtype=np.float64)
+        log_product = np.sum(np.log(magnitudes + np.finfo(np.float32).tiny), axis=0)
+        peak = int(np.argmax(log_product))
+        start = self.stats.record('band', start)
+
+        fractional_point = interpolate_peaks(log_product[np.newaxis], np.array([peak]), 'quadratic')[0]
+        refined = frequency + (fractional_point - len(self.offsets) // 2) * self.spacing
+        amplitude = self.samples * np.exp(log_product[peak])
+        self.stats.record('peak', start)
+
+        # share of the frame energy in each harmonic (1 for a pure tone), a stale lock on another note misses most of
+        # them
+        energy = np.dot(self.frame, self.frame) * self.sinusoid_gain
+        present = np.count_nonzero(np.square(magnitudes[:, peak]) >= self.min_harmonic_energy * energy)
+        locked = 0 < peak < len(self.offsets) - 1 and amplitude >= self.amplitude_threshold and \
+            2 * present > len(magnitudes)
+        return refined, amplitude, locked
+
+    def analyze(self, signal):
+        """
+        Analyzes a frame and finds its loudest (fundamental) frequency, in the narrow band of the tracked note if any
+
+        :param signal: the input audio signal in numpy array format (truncated or zero padded to the frame length)
+        :return: a tuple with the loudest frequency and loudest frequency amplitude
+        """
+
+        # apply window function into the frame buffer (the full-band detector overwrites its own)
+        n = min(len(signal), self.samples)
+        np.multiply(signal[:n], self.coarse.window[:n], out=self.frame[:n])
+        self.frame[n:] = 0
+
+        if self.tracked is not None and self.locked_frames < self.recheck:
+            frequency, amplitude, locked = self.refine(self.tracked)
+            if locked:
+                self.tracked = frequency
+                self.locked_frames += 1
+                return frequency, amplitude
+        self.tracked = None
+
+        # full-band detection, lock on its peak and refine it right away
+        frequency, amplitude = self.coarse.analyze(signal)
+        if min_frequency < frequency < max_frequency and amplitude >= self.amplitude_threshold:
+            refined, refined_amplitude, locked = self.refine(frequency)
+            if locked:
+                self.tracked = refined
+                self.locked_frames = 0
+                return refined, refined_amplitude
+        return frequency, amplitude
+
+    def analyze_frames(self, frames):
+        return self.coarse.analyze_frames(frames)
+
+    def frequencies(self):
+        return self.coarse.frequencies()
+
+
+class multi_resolution_detector:
+    """
+    FFT/HPS detector that analyzes several window lengths ending at the newest sample of the frame and reports the
+    shortest one that resolves the detected note
+
+    The frame (e.g. the ring buffer window of the pipeline) is the shared sample history, each level analyzes the
+    newest samples of it: the whole frame, half of it, a quarter and so on. Starting from the shortest window, a
+    detection is accepted when a semitone around it spans at least bins_per_semitone frequency bins of that window, so
+    high notes are found from a few tens of milliseconds of signal (they show up as soon as they are played) and low
+    notes still get the whole frame. A short window is not trusted when it holds about as much energy at half or a
+    third of the detected frequency (an overtone of a lower note won the HPS of the short window), longer windows are
+    tried instead.
+
+    The shorter windows always use a Hann window and Gaussian interpolation (their bins are the coarsest, the sub-bin
+    error of the other choices is several cents), the whole frame uses the given options. Amplitudes of shorter windows
+    are scaled to the frame length and window, so amplitude_threshold keeps its meaning.
+    """
+
+    def __init__(self, sample_rate, samples, levels=4, bins_per_semitone=2.0, max_subharmonic=0.3, **options):
+        """
+        :param sample_rate: the sample rate of the audio signal
+        :param samples: the number of samples in each frame (the longest window)
+        :param levels: the number of window lengths, each half as long as the previous one
+        :param bins_per_semitone: the number of frequency bins a semitone must span to accept a detection (lower values
+        use shorter windows, with less precise frequencies)
+        :param max_subharmonic: the maximum magnitude at half and a third of a detected frequency, relative to the
+        magnitude at the frequency, for a shorter window to be accepted
+        :param options: keyword arguments passed to the spectrum_analyzer of every level (window, harmonics, ...),
+        window and interpolation only apply to the whole frame
+        """
+        self.sample_rate = sample_rate
+        self.samples = samples
+        self.max_subharmonic = max_subharmonic
+
+        # shortest window first
+        short_options = dict(options, window='hann', interpolation='gaussian')
+        self.analyzers = [spectrum_analyzer(sample_rate, samples >> level, **(short_options if level else options))
+                          for level in reversed(range(levels))]
+        self.amplitude_threshold = self.analyzers[-1].amplitude_threshold
+        semitone = 2 ** (1 / 12) - 1
+        self.min_resolved = [bins_per_semitone * sample_rate / (analyzer.samples * semitone)
+                             for analyzer in self.analyzers]
+        # the amplitude is the window length times the magnitudes of harmonics terms, each proportional to the sum of
+        # the window function
+        gain = np.sum(self.analyzers[-1].window, dtype=np.float64)
+        self.scales = [samples / analyzer.samples *
+                       (gain / np.sum(analyzer.window, dtype=np.float64)) ** analyzer.harmonics
+                       for analyzer in self.analyzers]
+        self.counters = ['{}ms'.format(round(1000 * analyzer.samples / sample_rate)) for analyzer in self.analyzers]
+
+    @property
+    def stats(self):
+        return self.analyzers[-1].stats
+
+    @stats.setter
+    def stats(self, stats):
+        for analyzer in self.analyzers:
+            analyzer.stats = stats
+
+    def resolved(self, analyzer, frames, frequency, amplitude, min_resolved):
+        """
+        :param frames: the analyzed windows (one per row)
+        :return: a boolean numpy array, True for the detections the windows resolve
+        """
+        resolved = (frequency >= min_resolved) & (amplitude >= self.amplitude_threshold)
+        if not resolved.any():
+            return resolved
+
+        # DFT of the windowed frames at the frequency and at half and a third of it
+        rows = np.flatnonzero(resolved)
+        windowed = frames[rows] * analyzer.window
+        times = np.arange(analyzer.samples) / self.sample_rate
+        ratios = np.array([1, 1 / 2, 1 / 3])
+        kernels = np.exp(-2j * np.pi * (frequency[rows, np.newaxis, np.newaxis] * ratios[:, np.newaxis]) * times)
+        magnitude = np.abs(np.einsum('rkn,rn->rk', kernels, windowed))
+        resolved[rows] = magnitude[:, 1:].max(axis=1) <= self.max_subharmonic * magnitude[:, 0]
+        return resolved
+
+    def analyze(self, signal):
+        """
+        Analyzes the newest samples of a frame with the shortest window that resolves its loudest (fundamental)
+        frequency
+
+        :param signal: the input audio signal in numpy array format (the newest samples last)
+        :return: a tuple with the loudest frequency and loudest frequency amplitude
+        """
+        for analyzer, min_resolved, scale, counter in zip(self.analyzers, self.min_resolved, self.scales,
+                                                          self.counters):
+            window = signal[-analyzer.samples:]
+            frequency, amplitude = analyzer.analyze(window)
+            amplitude *= scale
+            if analyzer is self.analyzers[-1] or self.resolved(analyzer, window[np.newaxis], np.array([frequency]),
+                                                               np.array([amplitude]), min_resolved)[0]:
+                break
+        self.stats.count(counter)
+        return frequency, amplitude
+
+    def analyze_frames(self, frames):
+        """
+        Analyzes a batch of frames, each level only transforms the frames not resolved by a shorter window
+
+        :param frames: a 2-D numpy array (or strided view) with one frame of length samples per row
+        :return: a tuple with numpy arrays of the loudest frequency and loudest frequency amplitude of each frame
+        """
+        frequency = np.zeros(len(frames))
+        amplitude = np.zeros(len(frames))
+        pending = np.arange(len(frames))
+        for analyzer, min_resolved, scale in zip(self.analyzers[:-1], self.min_resolved, self.scales):
+            if not len(pending):
+                break
+            windows = frames[pending, -analyzer.samples:]
+            frequency[pending], amplitude[pending] = analyzer.analyze_frames(windows)
+            amplitude[pending] *= scale
+            pending = pending[~self.resolved(analyzer, windows, frequency[pending], amplitude[pending], min_resolved)]
+        if len(pending):
+            frequency[pending], amplitude[pending] = self.analyzers[-1].analyze_frames(frames[pending])
+        return frequency, amplitude
+
+    def frequencies(self):
+        return self.analyzers[-1].frequencies()
+
+
+pitch_detectors = {
+    'hps': spectrum_analyzer,
+    'yin': yin_detector,
+    'mpm': mpm_detector,
+    'tracking': tracking_detector,
+    'multires': multi_resolution_detector,
+}
+
+
+def create_pitch_detector(sample_rate, samples, detector='hps', **options):
+    """
+    Returns a new pitch detector for the given sample rate, frame length and options
+
+    :param sample_rate: the sample rate of the audio signal
+    :param samples: the number of samples in each frame
+    :param detector: the detector name (a key of pitch_detectors)
+    :param options: keyword arguments passed to the detector
+    :return: a pitch detector instance
+    """
+    if detector not in pitch_detectors:
+        raise ValueError('Unknown pitch detector: {}.'.format(detector))
+    return pitch_detectors[detector](sample_rate, samples, **options)
+
+
+@lru_cache(maxsize=8)
+def get_pitch_detector(sample_rate, samples, detector='hps', **options):
+    """
+    Returns a cached pitch detector shared by every caller with the same arguments (see create_pitch_detector), use
+    create_pitch_detector for a detector with stats or state of its own
+    """
+    return create_pitch_detector(sample_rate, samples, detector, **options)
+
+
+def pitch_track(signal, sample_rate, window=1, hop=0.05, f_0=440.0, batch_size=64, analyzer_options=None,
+                analyzer=None):
+    """
+    Computes the pitch track of a whole audio signal (used for offline analysis of recordings)
+
+    :param signal: the input audio signal in numpy array format
+    :param sample_rate: the sample rate of the audio signal
+    :param window: the length of the analysis window in seconds
+    :param hop: the time between consecutive windows in seconds
+    :param f_0: the frequency of A4 note (default: 440.0)
+    :param batch_size: the number of frames transformed together
+    :param analyzer_options: keyword arguments for get_pitch_detector (detector name and its options)
+    :param analyzer: a detector from create_pitch_detector to continue the stream of a previous call with (the signal
+    must start with the first frame after the previous one), None analyzes the signal on its own
+    :return: a tuple of numpy arrays with the time (centre of each frame in seconds), loudest frequency, closest note
+    name with octave ('' if no note was detected), cents offset from the closest note (nan if no note was detected)
+    and loudest frequency amplitude
+    """
+
+    frame_size = int(sample_rate * window)
+    hop_size = int(sample_rate * hop)
+    frames = frame_signal(signal, frame_size, hop_size)
+
+    if analyzer is None:
+        options = analyzer_options or {}
+        if hasattr(pitch_detectors.get(options.get('detector', 'hps')), 'analyze_sequence'):
+            # the frames are consecutive, a detector of its own follows the note from frame to frame
+            analyzer = create_pitch_detector(sample_rate, frame_size, **options)
+        else:
+            analyzer = get_pitch_detector(sample_rate, frame_size, **options)
+    analyze = analyzer.analyze_sequence if hasattr(analyzer, 'analyze_sequence') else analyzer.analyze_frames
+    frequency = np.empty(len(frames))
+    amplitude = np.empty(len(frames))
+    for start in range(0, len(frames), batch_size):
+        batch = slice(start, start + batch_size)
+        frequency[batch], amplitude[batch] = analyze(frames[batch])
+
+    time = (np.arange(len(frames)) * hop_size + frame_size / 2) / sample_rate
+
+    # map all frequencies to notes in one pass
+    min_amplitude = analyzer.amplitude_threshold
+    _, closest_note, octave, cents, _ = frequency_to_note_details(frequency, amplitude, f_0, min_amplitude)
+    note = np.char.add(closest_note, octave)
+
+    return time, frequency, note, cents, amplitude
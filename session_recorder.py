@@ -0,0 +1,157 @@
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from batch_analysis import track_columns
+
+record_dtype = np.dtype([('time', '<f8'), ('frequency', '<f8'), ('note', 'S4'), ('cents', '<f4'), ('amplitude', '<f8'),
+                         ('channel', '<u2')])
+
+
+class session_recorder:
+    """
+    Records the captured audio and the analysis results of a session in the background (used to reproduce wrong
+    readings)
+
+    The audio is streamed to '<prefix>.wav' (32 bit float) and the results to '<prefix>.npz' with the columns of a pitch
+    track (time, frequency, note, cents, amplitude and channel for multi-channel sources, the voice for polyphonic
+    results). Time is the end of the analyzed window in the recording, so the session can be replayed through the
+    pipeline (see benchmark.py -sessions).
+
+    Blocks and results wait in a bounded queue and are written in batches by a writer thread; when the queue is full
+    they are dropped (and counted) instead of delaying capture or display. Results are appended to a fixed-size record
+    file while recording and converted to columns on close, so memory use does not grow with the session length.
+    """
+
+    def __init__(self, prefix, rate, channels=1, multiple=None, queue_size=256, batch_size=32):
+        """
+        :param prefix: the output file name without extension
+        :param rate: the sample rate of the recorded audio
+        :param channels: the number of channels of the recorded audio
+        :param multiple: True if every result is an audio_pipeline.multi_result (several channels or voices), default:
+        channels > 1
+        :param queue_size: the maximum number of blocks and results waiting to be written
+        :param batch_size: the maximum number of items written at once
+        """
+        self.prefix = prefix
+        self.rate = rate
+        self.channels = channels
+        self.batch_size = batch_size
+        self.items = queue.Queue(queue_size)
+
+        self.samples = 0  # samples queued for writing (the recording timeline)
+        self.dropped = 0  # blocks and results dropped because the writer was behind
+        self.audio_bytes = 0
+        self.records = 0
+        self.multiple = channels > 1 if multiple is None else multiple
+
+        self.audio_file = open(prefix + '.wav', 'wb')
+        self.audio_file.write(self.wave_header(0))
+        self.record_file = open(prefix + '.records', 'wb')
+        self.writer = threading.Thread(target=self.run, name='session_recorder', daemon=True)
+        self.writer.start()
+
+    def wave_header(self, data_size):
+        block_align = 4 * self.channels
+        return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 3, self.channels,
+                           self.rate, self.rate * block_align, block_align, 32, b'data', data_size)
+
+    def put(self, item):
+        try:
+            self.items.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def write_audio(self, block):
+        """
+        Queues a block of captured audio, never blocks
+
+        :param block: the block in numpy array format (shape (samples, channels) for several channels)
+        """
+        if self.put(('audio', block)):
+            self.samples += len(block)
+
+    def write_result(self, result):
+        """
+        Queues the analysis result of the window ending with the last queued block, never blocks
+
+        :param result: an audio_pipeline.analysis_result (a multi_result of them for multi-channel sources or polyphonic
+        analysis)
+        """
+        self.put(('result', self.samples / self.rate, result))
+
+    def run(self):
+        while True:
+            batch = [self.items.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.items.get_nowait())
+                except queue.Empty:
+                    break
+
+            audio = []
+            records = []
+            for item in batch:
+                if item is None:
+                    continue
+                if item[0] == 'audio':
+                    audio.append(np.ascontiguousarray(item[1], dtype=np.float32).tobytes())
+                else:
+                    _, time, result = item
+                    results = result if self.multiple else (result,)
+                    for channel, channel_result in enumerate(results):
+                        voiced = channel_result.note is not None
+                        records.append((time, channel_result.frequency,
+                                        (channel_result.note + channel_result.octave).encode() if voiced else b'',
+                                        channel_result.cents if voiced else np.nan, channel_result.amplitude, channel))
+
+            if audio:
+                data = b''.join(audio)
+                self.audio_file.write(data)
+                self.audio_bytes += len(data)
+            if records:
+                self.record_file.write(np.array(records, dtype=record_dtype).tobytes())
+                self.records += len(records)
+
+            if batch[-1] is None:
+                return
+
+    def close(self):
+        """
+        Writes the remaining items and finishes both files
+        """
+        self.items.put(None)
+        self.writer.join()
+
+        self.audio_file.seek(0)
+        self.audio_file.write(self.wave_header(self.audio_bytes))
+        self.audio_file.close()
+        self.record_file.close()
+
+        # convert the records to columns, reading them through a memory map
+        records_name = self.prefix + '.records'
+        if self.records:
+            records = np.memmap(records_name, dtype=record_dtype, mode='r', shape=(self.records,))
+        else:
+            records = np.zeros(0, dtype=record_dtype)
+        columns = {column: records[column] for column in track_columns}
+        columns['note'] = records['note'].astype(str)
+        if self.multiple:
+            columns['channel'] = records['channel']
+        np.savez(self.prefix + '.npz', **columns)
+        del records
+        os.remove(records_name)
+
+
+def load_session(prefix):
+    """
+    :param prefix: the file name of a recorded session without extension
+    :return: a tuple with the audio file name and a dictionary of the recorded result columns
+    """
+    with np.load(prefix + '.npz') as columns:
+        return prefix + '.wav', dict(columns)